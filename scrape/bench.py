@@ -0,0 +1,590 @@
+import argparse
+import functools
+import hashlib
+import html
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from const import *
+from tokenizer import *
+from util import *
+
+BENCH_HOST = "127.0.0.1"
+BENCH_LINKS = 10
+BENCH_PAGES = 200
+BENCH_PARAGRAPHS = 40
+BENCH_QUERIES = 200
+BENCH_QUERY_WORDS = 4
+FAKE_EMBEDDING_SIZE = 256
+# words of fixture pages are drawn uniformly from a large vocabulary,
+# pages of a small one would all look like near-duplicates of each other
+SITE_VOCABULARY_SIZE = 5000
+SITE_SYLLABLES = ["ba", "co", "da", "fe", "gi", "ho", "ju", "ka", "lo", "mi", "nu", "pa", "qui",
+                  "ro", "su", "ta", "ve", "wo", "xa", "ze", "an", "el", "ir", "on", "us"]
+# seconds scripts may take to parse --help, above a bare interpreter start
+STARTUP_BUDGET = 0.5
+STARTUP_SCRIPTS = ["scrape.py", "upload.py", "query.py", "pipeline.py"]
+# packages loaded on first use, none of them may be imported to parse arguments
+STARTUP_HEAVY_MODULES = ["chromadb", "numpy", "openai", "requests", "tiktoken", "unstructured"]
+STUB_LATENCY = 0.05
+STUB_RATE_LIMIT_SHARE = 0.05
+STUB_RETRY_AFTER = 0.1
+
+# fixtures
+
+
+def generate_document(line_count, seed=0):
+    words = ["adobe", "express", "template", "flyer", "banner", "social", "post", "design",
+             "share", "content", "brand", "photo", "video", "editor", "account", "plan"]
+    generator = random.Random(seed)
+    lines = ["Title: " + " ".join(generator.choices(words, k=6))]
+    for index in range(line_count):
+        category = generator.choice(["NarrativeText", "Title", "ListItem"])
+        text = " ".join(generator.choices(words, k=generator.randint(4, 40)))
+        lines.append(f"{index + 1}. {text}" if category == "ListItem" else f"{category}: {text}")
+    return "\n".join(lines)
+
+
+def extract_chunks_quadratic(text, token_limit, quiet = False):
+    # baseline implementation re-tokenizing the growing chunk for every line, kept verbatim
+    # to check chunk boundaries and measure the speedup; it truncated by characters, not tokens,
+    # so chunks match only while no title or line is over its limit, as in generated documents
+    import regex
+    chunks = []
+    new_chunk = True
+    title = ""
+    title_done = False
+    title_token_limit = token_limit / 5
+    truncation = regex.compile(r"\p{P}", regex.UNICODE, cache_pattern=True)
+    def truncate_text(text, token_count, token_limit):
+        text_len = len(text)
+        extra_length = math.ceil(
+            (text_len/token_count) * (token_count - token_limit))
+        if extra_length < 1:
+            return text
+        match = truncation.search(text, endpos=text_len - extra_length)
+        if match:
+            return text[:extra_length - match.end()]
+        else:
+            return text
+    for line in text.split("\n"):
+        if not title_done and line.startswith("Title:"):
+            title += f"{line}\n"
+            token_count = len(encode_text(title))
+            if token_count > title_token_limit:
+                title = truncate_text(title, token_count, title_token_limit)
+                if not quiet:
+                    log(f"Truncated title:\n{title}")
+                title_done = True
+        else:
+            title_done = True
+            chunk = ""
+            if chunks:
+                chunk = f"{chunks[-1]}{line}\n"
+                token_count = len(encode_text(chunk))
+                if token_count > token_limit:
+                    new_chunk = True
+            if new_chunk:
+                new_chunk = False
+                chunk = f"{title}{line}\n"
+                token_count = len(encode_text(chunk))
+                if token_count > token_limit:
+                    chunk = truncate_text(chunk, token_count, token_limit)
+                    if not quiet:
+                        log(f"Truncated text:\n{chunk}")
+                chunks.append(chunk)
+            else:
+                chunks[-1] = chunk
+    return chunks
+
+
+def generate_vocabulary(seed=0):
+    generator = random.Random(seed)
+    words = set()
+    while len(words) < SITE_VOCABULARY_SIZE:
+        words.add("".join(generator.choices(SITE_SYLLABLES, k=generator.randint(2, 4))))
+    return sorted(words)
+
+
+def generate_site(site_folder, page_count=BENCH_PAGES, link_count=BENCH_LINKS, seed=0, paragraph_count=BENCH_PARAGRAPHS):
+    # every page links to the next one, so the whole site is reachable from the first page, and to random others
+    generator = random.Random(seed)
+    vocabulary = generate_vocabulary(seed)
+    os.makedirs(site_folder, exist_ok=True)
+    for index in range(page_count):
+        paragraphs = []
+        for _ in range(generator.randint(min(5, paragraph_count), paragraph_count)):
+            text = " ".join(generator.choices(vocabulary, k=generator.randint(8, 60)))
+            paragraphs.append(f"<p>{html.escape(text)}</p>")
+        targets = [(index + 1) % page_count] + generator.sample(range(page_count), min(link_count, page_count))
+        links = "".join(f'<li><a href="/page-{target}.html">Page {target}</a></li>' for target in targets)
+        with open(os.path.join(site_folder, f"page-{index}.html"), "w", encoding="utf-8") as file:
+            file.write(f"<html><head><title>Page {index}</title></head><body>"
+                       f"<h1>Page {index}</h1>{''.join(paragraphs)}<ul>{links}</ul></body></html>")
+
+
+def embed_hashed(texts):
+    # deterministic bag-of-words vectors, texts sharing words are close, no model or API is needed
+    embeddings = []
+    for text in texts:
+        vector = [0.0] * FAKE_EMBEDDING_SIZE
+        for word in re.findall(r"\w+", text.casefold()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            vector[int.from_bytes(digest[:4], "little") % FAKE_EMBEDDING_SIZE] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        embeddings.append([value / norm for value in vector])
+    return embeddings
+
+
+class QuietSiteHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LLMStubHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI compatible chat completions and embeddings endpoints answering after a fixed latency,
+    rejecting a share of chat requests with 429 and a Retry-After header, like a rate-limited API.
+    """
+
+    generator = random.Random(0)
+    latency = STUB_LATENCY
+    lock = threading.Lock()
+    rate_limit_share = STUB_RATE_LIMIT_SHARE
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if self.path.endswith("/chat/completions"):
+            time.sleep(self.latency)
+            with self.lock:
+                limited = self.generator.random() < self.rate_limit_share
+            if limited:
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests", "param": None, "code": None}},
+                               {"Retry-After": str(STUB_RETRY_AFTER)})
+                return
+            self.send_json(200, self.make_completion(body))
+        elif self.path.endswith("/embeddings"):
+            texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            token_count = sum(len(tokens) for tokens in encode_texts(texts))
+            self.send_json(200, {
+                "object": "list",
+                "data": [{"object": "embedding", "index": index, "embedding": embedding} for index, embedding in enumerate(embed_hashed(texts))],
+                "model": body.get("model"),
+                "usage": {"prompt_tokens": token_count, "total_tokens": token_count}
+            })
+        else:
+            self.send_json(404, {"error": {"message": f"Not found: {self.path}", "type": "invalid_request_error", "param": None, "code": None}})
+
+    def make_summary(self, text):
+        # questions and answers are made of words of the chunk, so they are searchable like real ones
+        words = re.findall(r"\w+", text)[-40:]
+        questions = [f"What is {' '.join(words[index:index + 3])}?" for index in range(0, min(len(words), 12), 6)]
+        answers = [" ".join(words[index:index + 12]) for index in range(0, min(len(words), 12), 6)]
+        return {"questions": questions, "answers": answers}
+
+    def make_completion(self, body):
+        # packed requests number their articles, they are replied to by article numbers
+        context = body["messages"][1]["content"]
+        articles = re.findall(r"^Article (\d+):\n```text\n(.*?)\n```$", context, re.DOTALL | re.MULTILINE)
+        if articles:
+            content = json.dumps({number: self.make_summary(text) for number, text in articles})
+        else:
+            content = json.dumps(self.make_summary(context))
+        prompt_tokens = count_dialog_tokens(body["messages"])
+        completion_tokens = len(encode_text(content))
+        return {
+            "id": f"chatcmpl-{hash_text(content)[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        }
+
+    def send_json(self, status, body, headers={}):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def reset_signals():
+    # forked servers inherit the graceful shutdown handlers of the scraping tools and would ignore terminate
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def serve_site(port_queue, site_folder):
+    reset_signals()
+    server = ThreadingHTTPServer((BENCH_HOST, 0), functools.partial(QuietSiteHandler, directory=site_folder))
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def serve_llm_stub(port_queue, latency, rate_limit_share, seed):
+    reset_signals()
+    LLMStubHandler.generator = random.Random(seed)
+    LLMStubHandler.latency = latency
+    LLMStubHandler.rate_limit_share = rate_limit_share
+    server = ThreadingHTTPServer((BENCH_HOST, 0), LLMStubHandler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server_process(serve, *args):
+    # servers run in their own processes, so they do not compete with the measured code for the interpreter lock
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(port_queue, *args), daemon=True)
+    process.start()
+    return [process, f"http://{BENCH_HOST}:{port_queue.get(timeout=30)}"]
+
+
+def stop_server_process(process):
+    process.terminate()
+    process.join()
+
+
+def make_fake_embedding_function():
+    from embedding import EmbeddingFunction
+    return EmbeddingFunction("fake", "hashed-bag-of-words", embed_hashed)
+
+
+def open_bench_collection(chroma_folder, embedding):
+    import chromadb
+    from embedding import get_collection_name, make_embedding_function
+    embedding_function = make_fake_embedding_function() if embedding == "fake" else make_embedding_function()
+    return chromadb.PersistentClient(chroma_folder).get_or_create_collection(
+        name=get_collection_name(embedding_function.backend), embedding_function=embedding_function)
+
+
+def get_percentile(timings, share):
+    ordered = sorted(timings)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)] if ordered else None
+
+
+def read_stage_metrics():
+    from metrics import METRICS
+    snapshot = METRICS.snapshot()
+    return {"counters": snapshot["counters"], "latency": snapshot["latency"]}
+
+
+def reset_stage_metrics():
+    from metrics import METRICS
+    METRICS.reset()
+
+
+def scrape_site(args, target_folder):
+    import scrape
+    from corpus import open_corpus
+    site_folder = os.path.join(target_folder, "site")
+    generate_site(site_folder, args.pages, args.links, args.seed, args.paragraphs)
+    [process, site_url] = start_server_process(serve_site, site_folder)
+    # politeness delay is left out, it would cap the measured throughput
+    scrape.FETCH_DELAY = args.fetch_delay
+    os.makedirs(os.path.join(target_folder, "data"))
+    corpus = open_corpus(os.path.join(target_folder, "data"))
+    try:
+        started = time.perf_counter()
+        scrape.scrape_url(f"{site_url}/page-0.html", corpus, re.compile(fr"^{re.escape(site_url)}/page-\d+\.html$"),
+                          args.pages, scrape.CONCURRENCY, scrape.CONCURRENCY, quiet=True)
+        elapsed = time.perf_counter() - started
+    finally:
+        stop_server_process(process)
+    return [corpus, elapsed]
+
+
+def upload_corpus(args, corpus, chroma_collection, llm_url):
+    import openai
+    import upload
+    from scheduler import Scheduler
+    from writer import ChromaWriter
+    openai.api_base = f"{llm_url}/v1"
+    openai.api_key = "bench"
+    # budgets are far above what the stub serves, only its latency and rate limiting hold requests back
+    scheduler = Scheduler(args.concurrency, 1000000, 100000000, quiet=True)
+    writer = ChromaWriter(chroma_collection, quiet=True)
+    packer = upload.ChunkPacker(scheduler, quiet=True) if args.pack else None
+    try:
+        started = time.perf_counter()
+        upload.upload_documents(chroma_collection, writer, scheduler, None, corpus, re.compile(r".*"),
+                                args.pages, args.concurrency, index_mode=args.index, quiet=True, packer=packer)
+        return time.perf_counter() - started
+    finally:
+        if packer:
+            packer.close()
+        scheduler.shutdown()
+
+
+def prepare_collection(args, target_folder, llm_url):
+    # scraped and uploaded without measuring, for scenarios benchmarking later stages
+    [corpus, _] = scrape_site(args, target_folder)
+    chroma_collection = open_bench_collection(os.path.join(target_folder, "chroma"), args.embedding)
+    upload_corpus(args, corpus, chroma_collection, llm_url)
+    return [corpus, chroma_collection]
+
+
+def generate_queries(corpus, query_count, seed=0):
+    # queries are spans of scraped texts, so every one has a page matching it literally
+    generator = random.Random(seed)
+    names = corpus.list_names()
+    queries = []
+    while names and len(queries) < query_count:
+        words = re.findall(r"\w+", corpus.read_text(generator.choice(names)))
+        if len(words) > BENCH_QUERY_WORDS:
+            start = generator.randrange(len(words) - BENCH_QUERY_WORDS)
+            queries.append(" ".join(words[start:start + BENCH_QUERY_WORDS]))
+    return queries
+
+# benchmark scenarios
+
+
+def measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return [result, min(timings)]
+
+
+def run_command(command, repeat):
+    # upload scripts refuse to start without the key, its value is not used to parse arguments
+    environment = {**os.environ, "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY") or "bench"}
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        process = subprocess.run(command, capture_output=True, env=environment, text=True)
+        timings.append(time.perf_counter() - started)
+    return [process, min(timings)]
+
+
+def find_imported_modules(command):
+    [process, _] = run_command([sys.executable, "-X", "importtime", *command], 1)
+    return {line.rsplit("|", 1)[-1].strip().split(".")[0] for line in process.stderr.splitlines() if line.startswith("import time:")}
+
+
+def bench_chunks(args):
+    from upload import extract_chunks
+    token_limit = math.floor(GPT_TOKEN_LIMIT / 2)
+    results = []
+    for line_count in args.lines:
+        text = generate_document(line_count)
+        token_count = len(encode_text(text))
+        [chunks, elapsed] = measure(lambda: extract_chunks(text, token_limit, True), args.repeat)
+        result = {
+            "lines": line_count,
+            "tokens": token_count,
+            "chunks": len(chunks),
+            "seconds": elapsed,
+            "chunks_per_second": len(chunks) / elapsed if elapsed else None,
+            "tokens_per_second": token_count / elapsed if elapsed else None
+        }
+        if args.compare:
+            [reference_chunks, reference_elapsed] = measure(
+                lambda: extract_chunks_quadratic(text, token_limit, True), 1)
+            result["reference_seconds"] = reference_elapsed
+            result["speedup"] = reference_elapsed / elapsed if elapsed else None
+            result["same_chunks"] = chunks == reference_chunks
+        results.append(result)
+    return results
+
+
+def bench_startup(args):
+    [_, baseline_seconds] = run_command([sys.executable, "-c", "pass"], args.repeat)
+    results = []
+    for script in STARTUP_SCRIPTS:
+        command = [os.path.join(os.path.dirname(os.path.abspath(__file__)), script), "--help"]
+        [process, seconds] = run_command([sys.executable, *command], args.repeat)
+        heavy_modules = sorted(find_imported_modules(command) & set(STARTUP_HEAVY_MODULES))
+        results.append({
+            "script": script,
+            "seconds": seconds,
+            "overhead_seconds": seconds - baseline_seconds,
+            "heavy_modules": heavy_modules,
+            "passed": process.returncode == 0 and not heavy_modules and seconds - baseline_seconds <= args.startup_budget
+        })
+        if not results[-1]["passed"]:
+            log(f"Startup budget exceeded: {script} {seconds - baseline_seconds:.3f}s, heavy modules: {heavy_modules}, exit code {process.returncode}")
+    return results
+
+
+def bench_scrape(args):
+    from frontier import count_urls, open_frontier
+    with tempfile.TemporaryDirectory() as target_folder:
+        reset_stage_metrics()
+        [corpus, elapsed] = scrape_site(args, target_folder)
+        frontier = open_frontier(corpus.target_folder)
+        [_, scraped_count] = count_urls(frontier)
+        frontier.close()
+        corpus.close()
+        return {
+            "pages": scraped_count,
+            "seconds": elapsed,
+            "pages_per_second": scraped_count / elapsed if elapsed else None,
+            **read_stage_metrics()
+        }
+
+
+def bench_upload(args):
+    with tempfile.TemporaryDirectory() as target_folder:
+        [corpus, _] = scrape_site(args, target_folder)
+        [process, llm_url] = start_server_process(serve_llm_stub, args.latency, args.rate_limit, args.seed)
+        try:
+            chroma_collection = open_bench_collection(os.path.join(target_folder, "chroma"), args.embedding)
+            reset_stage_metrics()
+            elapsed = upload_corpus(args, corpus, chroma_collection, llm_url)
+        finally:
+            stop_server_process(process)
+            corpus.close()
+        stage_metrics = read_stage_metrics()
+        counters = stage_metrics["counters"]
+        [document_count, chunk_count, token_count] = [
+            counters.get(name, 0) for name in ["upload.documents", "chunk.chunks", "llm.total_tokens"]]
+        return {
+            "documents": document_count,
+            "chunks": chunk_count,
+            "tokens": token_count,
+            "requests": counters.get("llm.requests", 0),
+            "retries": counters.get("llm.retries", 0),
+            "seconds": elapsed,
+            "documents_per_second": document_count / elapsed if elapsed else None,
+            "chunks_per_second": chunk_count / elapsed if elapsed else None,
+            "tokens_per_second": token_count / elapsed if elapsed else None,
+            **stage_metrics
+        }
+
+
+def bench_query(args):
+    from lexical import open_lexical_index
+    from query import DOCUMENT_LIMIT, LexicalSearch, search_chroma_db
+    results = {}
+    with tempfile.TemporaryDirectory() as target_folder:
+        # the stub stays up while querying, it embeds queries with the stub embedding
+        [process, llm_url] = start_server_process(serve_llm_stub, args.latency, args.rate_limit, args.seed)
+        try:
+            [corpus, chroma_collection] = prepare_collection(args, target_folder, llm_url)
+            queries = generate_queries(corpus, args.queries, args.seed)
+            for mode in ["vector", "lexical", "hybrid"]:
+                lexical_search = None
+                if mode != "vector":
+                    lexical_search = LexicalSearch(open_lexical_index(corpus.target_folder, False), corpus, mode == "hybrid")
+                # queries run one by one and uncached, like distinct queries to the query server
+                timings = []
+                for query_text in queries:
+                    started = time.perf_counter()
+                    search_chroma_db(chroma_collection, query_text, DOCUMENT_LIMIT, ["distances"], False, None, lexical_search)
+                    timings.append(time.perf_counter() - started)
+                if lexical_search:
+                    lexical_search.close()
+                results[mode] = {
+                    "queries": len(timings),
+                    "seconds": sum(timings),
+                    "queries_per_second": len(timings) / sum(timings) if sum(timings) else None,
+                    "p50": get_percentile(timings, 0.5),
+                    "p99": get_percentile(timings, 0.99)
+                }
+            corpus.close()
+        finally:
+            stop_server_process(process)
+    return results
+
+
+SCENARIOS = {
+    "startup": bench_startup,
+    "chunks": bench_chunks,
+    "scrape": bench_scrape,
+    "upload": bench_upload,
+    "query": bench_query,
+}
+
+# entry point
+
+
+def main(args):
+    report = {
+        "started": datetime.now().isoformat(),
+        # options are kept with results, only runs with the same options are comparable
+        "options": vars(args),
+        "scenarios": {}
+    }
+    for scenario in args.scenarios:
+        if not args.quiet:
+            log(f"Running benchmark: {scenario}")
+        report["scenarios"][scenario] = SCENARIOS[scenario](args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+    # scenarios checking budgets fail the run, so it can guard against regressions
+    if any(isinstance(results, list) and any(result.get("passed") is False for result in results)
+           for results in report["scenarios"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="""
+          I can benchmark hot paths of the scraping tools offline.
+          Just tell me which scenarios to run.
+          Enjoy!
+        """)
+    parser.add_argument(
+        "scenarios", nargs="*", choices=list(SCENARIOS), default=list(SCENARIOS), help="scenarios to run, all by default")
+    parser.add_argument(
+        "--lines", type=int, nargs="+", default=[100, 1000, 10000], help="numbers of lines in generated documents for chunks scenario")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="number of runs per measurement, the fastest one is reported")
+    parser.add_argument(
+        "--compare", action="store_true", help="also run reference implementations and compare results")
+    parser.add_argument(
+        "--pages", type=int, default=BENCH_PAGES, help=f"number of pages of the generated site, by default - {BENCH_PAGES}")
+    parser.add_argument(
+        "--links", type=int, default=BENCH_LINKS, help=f"number of random links on every generated page, by default - {BENCH_LINKS}")
+    parser.add_argument(
+        "--paragraphs", type=int, default=BENCH_PARAGRAPHS, help=f"maximum number of paragraphs of every generated page, by default - {BENCH_PARAGRAPHS}")
+    parser.add_argument(
+        "--fetch-delay", type=float, default=0, help="seconds to wait before every fetch, by default - 0")
+    parser.add_argument(
+        "--latency", type=float, default=STUB_LATENCY, help=f"seconds the Chat GPT stub takes to answer, by default - {STUB_LATENCY}")
+    parser.add_argument(
+        "--rate-limit", type=float, default=STUB_RATE_LIMIT_SHARE, help=f"share of Chat GPT stub requests rejected with 429, by default - {STUB_RATE_LIMIT_SHARE}")
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=8, help="maximum number of Chat GPT requests in parallel, by default - 8")
+    parser.add_argument(
+        "--pack", action="store_true", help="pack small chunks of several pages into shared Chat GPT requests")
+    parser.add_argument(
+        "-i", "--index", choices=["pages", "chunks"], default="pages", help="index mode of uploaded pages, by default - pages")
+    parser.add_argument(
+        "-e", "--embedding", choices=["fake", "stub"], default="fake", help="embed in process with hashed bag-of-words vectors, or with the OpenAI embeddings API of the stub, by default - fake")
+    parser.add_argument(
+        "--queries", type=int, default=BENCH_QUERIES, help=f"number of queries per search mode, by default - {BENCH_QUERIES}")
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed of generated pages, stub replies and queries, by default - 0")
+    parser.add_argument(
+        "--startup-budget", type=float, default=STARTUP_BUDGET, help=f"seconds scripts may take to parse --help above a bare interpreter start, by default - {STARTUP_BUDGET}")
+    parser.add_argument(
+        "-o", "--output", help="optional path to the JSON file to write results to")
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help=f"suppress logging to stdout")
+    args = parser.parse_args()
+    main(args)
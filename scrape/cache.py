@@ -0,0 +1,101 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+CACHE_SIZE_LIMIT = 1024 * 1024 * 1024
+# share of the size limit kept after eviction, so eviction does not run on every write
+CACHE_EVICTION_RATIO = 0.9
+
+
+def make_cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True).encode()).digest()
+
+
+class DiskCache:
+    """SQLite key-value cache evicting least recently used entries when its size exceeds the limit."""
+
+    def __init__(self, path, size_limit=CACHE_SIZE_LIMIT):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key BLOB PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.hits = 0
+        self.lock = threading.Lock()
+        self.misses = 0
+        self.size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        self.size_limit = size_limit
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def set(self, key, value):
+        size = len(key) + len(value)
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row:
+                self.size -= row[0]
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()))
+            self.size += size
+            if self.size > self.size_limit:
+                self.evict(self.size_limit * CACHE_EVICTION_RATIO)
+
+    def evict(self, target_size):
+        cursor = self.connection.execute(
+            "SELECT key, size FROM entries ORDER BY accessed")
+        evicted = []
+        for [key, size] in cursor:
+            if self.size <= target_size:
+                break
+            evicted.append((key,))
+            self.size -= size
+        cursor.close()
+        self.connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+    def get_json(self, key):
+        value = self.get(key)
+        return None if value is None else json.loads(value)
+
+    def set_json(self, key, value):
+        self.set(key, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "hit_rate": self.hits / total if total else 0,
+                "misses": self.misses,
+                "size": self.size
+            }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
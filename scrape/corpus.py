@@ -0,0 +1,284 @@
+import argparse
+import fcntl
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import threading
+import zlib
+
+from util import *
+
+CORPUS_STORAGES = ["files", "segments"]
+SEGMENT_FOLDER_NAME = "segments"
+SEGMENT_INDEX_NAME = "index.bin"
+SEGMENT_LOCK_NAME = "lock"
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# index entry: page name digest, record kind, segment number, offset, length
+INDEX_ENTRY = struct.Struct("<16scIQI")
+KIND_JSON = b"j"
+KIND_TEXT = b"t"
+# record length prefix in compressed segments
+RECORD_LENGTH = struct.Struct("<I")
+
+
+class FileCorpus:
+    """Pages stored as <name>.json and <name>.txt file pairs in the data folder."""
+
+    storage = "files"
+
+    def __init__(self, target_folder):
+        self.target_folder = target_folder
+
+    def list_names(self):
+        return [change_extension(f, '') for f in os.listdir(self.target_folder) if f.endswith('.json')]
+
+    def read_json(self, name):
+        with open(os.path.join(self.target_folder, name + ".json"), "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def read_text(self, name):
+        with open(os.path.join(self.target_folder, name + ".txt"), "r", encoding="utf-8") as file:
+            return file.read()
+
+    def write_json(self, name, document):
+        with open(os.path.join(self.target_folder, name + ".json"), "w", encoding="utf-8") as file:
+            json.dump(document, file, ensure_ascii=False, indent=2)
+
+    def write_text(self, name, text):
+        with open(os.path.join(self.target_folder, name + ".txt"), "w", encoding="utf-8") as file:
+            file.write(text)
+
+    def delete(self, name):
+        for extension in [".json", ".txt"]:
+            path = os.path.join(self.target_folder, name + extension)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close(self):
+        pass
+
+
+class SegmentCorpus:
+    """
+    Pages appended as records to rolling segment files, JSONL or zlib-compressed,
+    with an append-only index of record offsets keyed by page name.
+    Rewriting a page appends a new record, the index keeps the latest one.
+    """
+
+    storage = "segments"
+
+    def __init__(self, target_folder, compress=False):
+        self.segment_folder = os.path.join(target_folder, SEGMENT_FOLDER_NAME)
+        os.makedirs(self.segment_folder, exist_ok=True)
+        self.compress = compress
+        self.index = {}
+        self.index_size = 0
+        self.lock = threading.Lock()
+        # serialises appends of several processes writing to the same folder
+        self.lock_file = open(os.path.join(self.segment_folder, SEGMENT_LOCK_NAME), "a")
+        self.maps = {}
+        self.segment = 1
+        self.target_folder = target_folder
+        self.read_index()
+
+    def segment_path(self, segment, compressed):
+        return os.path.join(self.segment_folder, f"segment-{segment:06d}.jsonl" + (".z" if compressed else ""))
+
+    def find_segment(self, segment):
+        path = self.segment_path(segment, True)
+        if os.path.exists(path):
+            return [path, True]
+        return [self.segment_path(segment, False), False]
+
+    def read_index(self):
+        # reads entries appended since the last call, by this or another process
+        path = os.path.join(self.segment_folder, SEGMENT_INDEX_NAME)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as file:
+            file.seek(self.index_size)
+            data = file.read()
+        size = len(data) - len(data) % INDEX_ENTRY.size
+        for [digest, kind, segment, offset, length] in INDEX_ENTRY.iter_unpack(data[:size]):
+            self.index[digest + kind] = [segment, offset, length]
+            self.segment = max(self.segment, segment)
+        self.index_size += size
+
+    def read_record(self, name, kind):
+        key = bytes.fromhex(name) + kind
+        with self.lock:
+            if key not in self.index:
+                self.read_index()
+            if key not in self.index:
+                raise FileNotFoundError(f"Page not found in segments: {name}")
+            [segment, offset, length] = self.index[key]
+            [path, compressed] = self.find_segment(segment)
+            segment_map = self.maps.get(segment)
+            if segment_map is None or len(segment_map) < offset + length:
+                if segment_map is not None:
+                    segment_map.close()
+                with open(path, "rb") as file:
+                    segment_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps[segment] = segment_map
+            data = segment_map[offset:offset + length]
+        if compressed:
+            data = zlib.decompress(data[RECORD_LENGTH.size:])
+        return json.loads(data)
+
+    def write_record(self, name, kind, record):
+        data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+        with self.lock:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            try:
+                self.append_record(name, kind, data)
+            finally:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def append_record(self, name, kind, data):
+        self.read_index()
+        [path, compressed] = self.find_segment(self.segment)
+        if os.path.exists(path) and (compressed != self.compress or os.path.getsize(path) >= SEGMENT_SIZE):
+            self.segment += 1
+            path = self.segment_path(self.segment, self.compress)
+            compressed = self.compress
+        elif not os.path.exists(path):
+            path = self.segment_path(self.segment, self.compress)
+            compressed = self.compress
+        if compressed:
+            data = zlib.compress(data)
+            data = RECORD_LENGTH.pack(len(data)) + data
+        else:
+            data += b"\n"
+        with open(path, "ab") as file:
+            offset = file.seek(0, os.SEEK_END)
+            file.write(data)
+        entry = INDEX_ENTRY.pack(bytes.fromhex(name), kind, self.segment, offset, len(data))
+        with open(os.path.join(self.segment_folder, SEGMENT_INDEX_NAME), "ab") as file:
+            file.write(entry)
+        self.index[bytes.fromhex(name) + kind] = [self.segment, offset, len(data)]
+        self.index_size += len(entry)
+
+    def list_names(self):
+        with self.lock:
+            self.read_index()
+            return [key[:-1].hex() for key in self.index if key[-1:] == KIND_JSON]
+
+    def read_json(self, name):
+        return self.read_record(name, KIND_JSON)["document"]
+
+    def read_text(self, name):
+        return self.read_record(name, KIND_TEXT)["text"]
+
+    def write_json(self, name, document):
+        self.write_record(name, KIND_JSON, {"name": name, "document": document})
+
+    def write_text(self, name, text):
+        self.write_record(name, KIND_TEXT, {"name": name, "text": text})
+
+    def remove(self):
+        self.close()
+        shutil.rmtree(self.segment_folder)
+
+    def close(self):
+        with self.lock:
+            for segment_map in self.maps.values():
+                segment_map.close()
+            self.maps = {}
+            self.lock_file.close()
+
+
+def get_stored_storages(target_folder):
+    # storages already holding pages in the data folder
+    storages = []
+    if any(entry.name.endswith(".json") for entry in os.scandir(target_folder)):
+        storages.append("files")
+    index_path = os.path.join(target_folder, SEGMENT_FOLDER_NAME, SEGMENT_INDEX_NAME)
+    if os.path.exists(index_path) and os.path.getsize(index_path):
+        storages.append("segments")
+    return storages
+
+
+def handle_storage_arg(args, target_folder):
+    # pages of the other storage would not be found by the frontier and uploads, they are converted first
+    storage = getattr(args, 'storage', None)
+    stored_storages = get_stored_storages(target_folder)
+    if storage is None or storage in stored_storages or not stored_storages:
+        return storage or (stored_storages[-1] if stored_storages else "files")
+    log(f"Argument 'storage' is not valid: {storage}, the data folder holds {stored_storages[0]} pages, "
+        f"convert them with corpus.py first")
+    return None
+
+
+def open_corpus(target_folder, storage=None, compress=False):
+    if storage is None:
+        storage = "segments" if os.path.exists(os.path.join(target_folder, SEGMENT_FOLDER_NAME)) else "files"
+    if storage == "segments":
+        return SegmentCorpus(target_folder, compress)
+    return FileCorpus(target_folder)
+
+
+def convert_corpus(source_corpus, target_corpus, delete=False, quiet=False):
+    names = source_corpus.list_names()
+    if not quiet:
+        log(f"Converting pages: {len(names)} from {source_corpus.storage} to {target_corpus.storage}")
+    converted_count = 0
+    for name in names:
+        try:
+            target_corpus.write_text(name, source_corpus.read_text(name))
+            target_corpus.write_json(name, source_corpus.read_json(name))
+            if delete and source_corpus.storage == "files":
+                source_corpus.delete(name)
+            converted_count += 1
+        except:
+            log(f"Failed to convert page: {name}")
+    # segments can only be deleted all together
+    if delete and source_corpus.storage == "segments" and converted_count == len(names):
+        source_corpus.remove()
+    if not quiet:
+        log(f"Converted pages: {converted_count}")
+    return converted_count
+
+# entry point
+
+
+def main(args):
+    target_folder = handle_folder_arg(args, False)
+    if not target_folder:
+        sys.exit(1)
+    source_storage = "files" if args.storage == "segments" else "segments"
+    log(f"Ready to convert scraped pages using args:")
+    log(f"  Path to target folder: {target_folder}")
+    log(f"  Storage: {source_storage} -> {args.storage}")
+    source_corpus = open_corpus(target_folder, source_storage)
+    target_corpus = open_corpus(target_folder, args.storage, args.compress)
+    try:
+        convert_corpus(source_corpus, target_corpus, args.delete, args.quiet)
+    finally:
+        source_corpus.close()
+        target_corpus.close()
+    log("Bye!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="""
+          I can convert scraped pages between storage formats.
+          Just tell me the path to the folder where scraped data is stored and the target storage.
+          Enjoy!
+        """)
+    parser.add_argument(
+        "folder", help="path to the data folder")
+    parser.add_argument(
+        "storage", choices=CORPUS_STORAGES, help="storage to convert scraped pages to")
+    parser.add_argument(
+        "-z", "--compress", action="store_true", help=f"compress records of new segments")
+    parser.add_argument(
+        "-d", "--delete", action="store_true", help=f"delete converted pages from the source storage")
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help=f"suppress logging to stdout")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,113 @@
+import array
+
+from cache import *
+from metrics import *
+from tokenizer import *
+from util import *
+
+EMBEDDING_BACKENDS = ["openai", "local"]
+EMBEDDING_BACKEND = "openai"
+EMBEDDING_BATCH_SIZE = 512
+EMBEDDING_BATCH_TOKENS = 100000
+EMBEDDING_CACHE_FILE_NAME = "embeddings.sqlite"
+EMBEDDING_CACHE_SIZE = 1024
+# longer inputs are truncated, the OpenAI API rejects them
+EMBEDDING_INPUT_TOKENS = 8191
+LOCAL_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+def embed_openai(texts):
+    import openai
+    response = openai.Embedding.create(input=texts, model=OPENAI_EMBEDDING_MODEL)
+    count_metric("embed.usage_tokens", response.get("usage", {}).get("total_tokens", 0))
+    return [item["embedding"] for item in sorted(response["data"], key=lambda item: item["index"])]
+
+
+def make_local_embedder():
+    # ONNX build of all-MiniLM-L6-v2 shipped with Chroma, runs on CPU, downloaded once
+    from chromadb.utils import embedding_functions
+    embedding_function = embedding_functions.DefaultEmbeddingFunction()
+    return lambda texts: [list(map(float, vector)) for vector in embedding_function(texts)]
+
+
+class EmbeddingFunction:
+    """
+    Chroma embedding function looking up embeddings in an on-disk cache by model and text hash,
+    embedding missing texts with the backend in batches bounded by input count and tokens.
+    """
+
+    def __init__(self, backend, model_name, embed, cache=None, batch_size=EMBEDDING_BATCH_SIZE, batch_tokens=EMBEDDING_BATCH_TOKENS, input_tokens=None):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        self.cache = cache
+        self.embed = embed
+        self.input_tokens = input_tokens
+        self.model_name = model_name
+
+    def prepare_text(self, text):
+        if self.input_tokens is None:
+            return [text, count_text_tokens(text)]
+        tokens = encode_text(text)
+        if len(tokens) <= self.input_tokens:
+            return [text, len(tokens)]
+        return [decode_tokens(tokens[:self.input_tokens]), self.input_tokens]
+
+    def embed_batch(self, batch, batch_tokens):
+        count_metric("embed.batches")
+        count_metric("embed.texts", len(batch))
+        count_metric("embed.tokens", batch_tokens)
+        with timed("embed"):
+            return self.embed(batch)
+
+    def embed_batches(self, texts):
+        embeddings = []
+        batch = []
+        batch_tokens = 0
+        for text in texts:
+            [text, token_count] = self.prepare_text(text)
+            if batch and (len(batch) >= self.batch_size or batch_tokens + token_count > self.batch_tokens):
+                embeddings.extend(self.embed_batch(batch, batch_tokens))
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += token_count
+        if batch:
+            embeddings.extend(self.embed_batch(batch, batch_tokens))
+        return embeddings
+
+    def __call__(self, input):
+        keys = [make_cache_key(self.backend, self.model_name, text) for text in input]
+        embeddings = [None] * len(input)
+        if self.cache:
+            for index, key in enumerate(keys):
+                value = self.cache.get(key)
+                if value is not None:
+                    embeddings[index] = array.array("f", value).tolist()
+        missing = [index for index, embedding in enumerate(embeddings) if embedding is None]
+        if self.cache:
+            count_metric("embed.cache_hits", len(input) - len(missing))
+            count_metric("embed.cache_misses", len(missing))
+        if missing:
+            for index, embedding in zip(missing, self.embed_batches([input[index] for index in missing])):
+                # embeddings are cached as float32, fresh ones are rounded the same way,
+                # so a text embeds the same whether it was cached or not
+                embedding = array.array("f", embedding)
+                embeddings[index] = embedding.tolist()
+                if self.cache:
+                    self.cache.set(keys[index], embedding.tobytes())
+        return embeddings
+
+
+def make_embedding_function(backend=EMBEDDING_BACKEND, cache_path=None, cache_size=EMBEDDING_CACHE_SIZE, batch_size=EMBEDDING_BATCH_SIZE):
+    cache = DiskCache(cache_path, cache_size * 1024 * 1024) if cache_path else None
+    if backend == "local":
+        return EmbeddingFunction(backend, LOCAL_EMBEDDING_MODEL, make_local_embedder(), cache, batch_size)
+    return EmbeddingFunction(backend, OPENAI_EMBEDDING_MODEL, embed_openai, cache, batch_size,
+                             input_tokens=EMBEDDING_INPUT_TOKENS)
+
+
+def get_collection_name(backend):
+    # embeddings of different backends differ in size, each backend has its own collection
+    return "documents" if backend == "openai" else f"documents-{backend}"
@@ -0,0 +1,62 @@
+import hashlib
+import re
+
+from collections import Counter
+
+SIMHASH_BITS = 64
+# a fingerprint is split into bands, pages differing in fewer bits than bands share at least one band
+SIMHASH_BANDS = 4
+SIMHASH_BAND_BITS = SIMHASH_BITS // SIMHASH_BANDS
+# words per shingle, shingles keep some word order in the fingerprint
+SIMHASH_SHINGLE = 3
+SIMILARITY_THRESHOLD = 0.95
+# thresholds must be above it, at lower ones near-duplicates may share no band and are never compared
+SIMILARITY_LIMIT = 1 - SIMHASH_BANDS / SIMHASH_BITS
+
+
+def hash_feature(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def compute_simhash(page_texts):
+    # returns None for pages without words, all of them would look alike
+    words = re.findall(r"\w+", " ".join(page_texts).casefold())
+    if not words:
+        return None
+    shingles = Counter(
+        " ".join(words[index:index + SIMHASH_SHINGLE]) for index in range(max(len(words) - SIMHASH_SHINGLE + 1, 1)))
+    weights = [0] * SIMHASH_BITS
+    for shingle, count in shingles.items():
+        feature = hash_feature(shingle)
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += count if feature >> bit & 1 else -count
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def compute_page_simhash(text):
+    # text of a saved page, one "Category: text" line per element; categories are left out, they are alike on all pages
+    return compute_simhash([line.split(": ", 1)[-1] for line in text.split("\n")])
+
+
+def get_simhash_bands(simhash):
+    # band number in the high bits keeps equal values of different bands apart
+    mask = (1 << SIMHASH_BAND_BITS) - 1
+    return [band << SIMHASH_BAND_BITS | simhash >> (band * SIMHASH_BAND_BITS) & mask for band in range(SIMHASH_BANDS)]
+
+
+def get_max_distance(similarity):
+    # bits two fingerprints may differ in to be considered near-duplicates
+    return int((1 - similarity) * SIMHASH_BITS)
+
+
+def get_distance(simhash, other_simhash):
+    return bin(simhash ^ other_simhash).count("1")
+
+
+def to_signed(simhash):
+    # SQLite integers are signed 64-bit
+    return simhash - (1 << SIMHASH_BITS) if simhash >= 1 << (SIMHASH_BITS - 1) else simhash
+
+
+def to_unsigned(simhash):
+    return simhash + (1 << SIMHASH_BITS) if simhash < 0 else simhash
@@ -0,0 +1,357 @@
+import array
+import hashlib
+import heapq
+import os
+import sqlite3
+
+from bisect import bisect_left
+
+from fingerprint import *
+from util import *
+
+FRONTIER_FILE_NAME = "frontier.sqlite"
+MIGRATION_BATCH_SIZE = 1000
+# minimal number of hashes added to the visited set before they are merged into its sorted array
+VISITED_BUFFER_SIZE = 65536
+
+URL_PENDING = 0
+URL_SCRAPED = 1
+URL_FAILED = 2
+URL_FETCHING = 3
+# near-duplicate of another scraped page, neither written nor uploaded
+URL_ALIAS = 4
+
+# statements upgrading the frontier from the previous schema version, applied in order
+SCHEMA_UPGRADES = [
+    [
+        "ALTER TABLE urls ADD COLUMN etag TEXT",
+        "ALTER TABLE urls ADD COLUMN modified TEXT",
+        "ALTER TABLE urls ADD COLUMN hash TEXT",
+        "ALTER TABLE urls ADD COLUMN checked INTEGER",
+        "ALTER TABLE urls ADD COLUMN changed INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS urls_checked ON urls (status, checked)",
+    ],
+    [
+        "CREATE INDEX IF NOT EXISTS urls_upload ON urls (status) WHERE uploaded = 0 OR changed = 1",
+    ],
+    [
+        "ALTER TABLE urls ADD COLUMN simhash INTEGER",
+        "ALTER TABLE urls ADD COLUMN alias TEXT",
+        """
+            CREATE TABLE IF NOT EXISTS simhash_bands (
+                band INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                PRIMARY KEY (band, url)
+            ) WITHOUT ROWID
+        """,
+    ],
+    [
+        "ALTER TABLE urls ADD COLUMN depth INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE urls ADD COLUMN priority REAL NOT NULL DEFAULT 0",
+        # pending URLs ordered by priority, the index is the persistent heap of the crawl
+        "CREATE INDEX IF NOT EXISTS urls_pending ON urls (status, priority)",
+    ],
+]
+
+
+class VisitedSet:
+    """
+    64-bit hashes of URLs known to the frontier, 8 bytes per URL, in a sorted array searched by bisection.
+    The array is loaded on first use from sorted hashes, so runs following no links do not read all URLs.
+    New hashes are collected in a set and merged into the array in bulk, once the set grows to a share of the array.
+    A hash collision makes a new URL look known, at a few million URLs the odds are about one in a million.
+    """
+
+    def __init__(self, load_hashes=None):
+        self.buffer = set()
+        self.hashes = None if load_hashes else array.array("q")
+        self.load_hashes = load_hashes
+
+    @staticmethod
+    def hash_url(url):
+        # signed, as SQLite integers are
+        return int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+    def get_hashes(self):
+        # the array is filled from the iterator directly, hashes are never held in a list
+        if self.hashes is None:
+            self.hashes = array.array("q", self.load_hashes())
+        return self.hashes
+
+    def __contains__(self, url):
+        url_hash = self.hash_url(url)
+        if url_hash in self.buffer:
+            return True
+        hashes = self.get_hashes()
+        index = bisect_left(hashes, url_hash)
+        return index < len(hashes) and hashes[index] == url_hash
+
+    def __len__(self):
+        return len(self.get_hashes()) + len(self.buffer)
+
+    def update(self, urls):
+        self.buffer.update(self.hash_url(url) for url in urls)
+        if len(self.buffer) >= max(VISITED_BUFFER_SIZE, len(self.get_hashes()) // 8):
+            self.merge()
+
+    def merge(self):
+        self.hashes = array.array("q", heapq.merge(self.get_hashes(), sorted(self.buffer)))
+        self.buffer = set()
+
+
+def load_visited_urls(frontier):
+    # hashes are sorted by SQLite, which spills to temporary files instead of holding them all in memory
+    frontier.create_function("hash_url", 1, VisitedSet.hash_url, deterministic=True)
+    return VisitedSet(lambda: (row[0] for row in frontier.execute(
+        "SELECT hash_url(url) AS url_hash FROM urls ORDER BY url_hash")))
+
+
+def open_frontier(target_folder):
+    frontier = sqlite3.connect(os.path.join(target_folder, FRONTIER_FILE_NAME))
+    frontier.execute("PRAGMA journal_mode = WAL")
+    frontier.execute("PRAGMA synchronous = NORMAL")
+    with frontier:
+        frontier.execute("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                name TEXT,
+                status INTEGER NOT NULL DEFAULT 0,
+                uploaded INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        frontier.execute(
+            "CREATE INDEX IF NOT EXISTS urls_status ON urls (status)")
+        frontier.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            ) WITHOUT ROWID
+        """)
+        version = frontier.execute("PRAGMA user_version").fetchone()[0]
+        for statements in SCHEMA_UPGRADES[version:]:
+            for statement in statements:
+                frontier.execute(statement)
+        frontier.execute(f"PRAGMA user_version = {len(SCHEMA_UPGRADES)}")
+    return frontier
+
+
+def release_fetching_urls(frontier):
+    # pages being fetched when the previous session stopped are pending again,
+    # only the crawl may do it, other connections would release pages it is fetching
+    with frontier:
+        frontier.execute(
+            "UPDATE urls SET status = ? WHERE status = ?", (URL_PENDING, URL_FETCHING))
+
+
+def get_meta(frontier, key, default_value=None):
+    row = frontier.execute(
+        "SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default_value
+
+
+def set_meta(frontier, key, value):
+    frontier.execute(
+        "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+        (key, value))
+
+
+def migrate_corpus(frontier, corpus, url_filter, quiet=False):
+    names = corpus.list_names()
+    if not quiet:
+        log(f"Migrating session to frontier: {len(names)} pages")
+    with frontier:
+        # depths of known URLs survive the migration, links of migrated pages are one level deeper
+        frontier.execute("CREATE TEMP TABLE migrated_depths (url TEXT PRIMARY KEY, depth INTEGER NOT NULL) WITHOUT ROWID")
+        frontier.execute("INSERT INTO migrated_depths SELECT url, depth FROM urls WHERE depth > 0")
+        # aliases are not in the corpus, they are kept while their canonical pages are migrated
+        aliases = frontier.execute(
+            "SELECT url, alias, checked FROM urls WHERE status = ?", (URL_ALIAS,)).fetchall()
+        frontier.execute("DELETE FROM urls")
+        frontier.execute("DELETE FROM simhash_bands")
+    for index in range(0, len(names), MIGRATION_BATCH_SIZE):
+        with frontier:
+            for name in names[index:index + MIGRATION_BATCH_SIZE]:
+                try:
+                    document = corpus.read_json(name)
+                except:
+                    log(f"Failed to migrate page: {name}")
+                    continue
+                url = document.get('url', '')
+                if len(url) and url_filter.match(url):
+                    # pages without chunks were never uploaded or were changed since
+                    uploaded = 'chunks' in document
+                    frontier.execute("""
+                        INSERT INTO urls (url, name, status, uploaded, changed, etag, modified, hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (url) DO UPDATE SET
+                            name = excluded.name, status = excluded.status, uploaded = excluded.uploaded, changed = excluded.changed,
+                            etag = excluded.etag, modified = excluded.modified, hash = excluded.hash
+                    """, (url, name, URL_SCRAPED, int(uploaded), int(not uploaded),
+                          document.get('etag'), document.get('modified'), document.get('hash')))
+                    # the near-duplicate index is rebuilt from page texts
+                    try:
+                        save_simhash(frontier, url, compute_page_simhash(corpus.read_text(name)))
+                    except:
+                        log(f"Failed to fingerprint page: {name}")
+                row = frontier.execute("SELECT depth FROM migrated_depths WHERE url = ?", (url,)).fetchone()
+                frontier.executemany(
+                    "INSERT OR IGNORE INTO urls (url, depth) VALUES (?, ?)",
+                    [(link_url, (row[0] if row else 0) + 1) for link_url in filter_links(document.get('links', []), url_filter)])
+    with frontier:
+        frontier.executemany("""
+            INSERT INTO urls (url, status, alias, checked) SELECT ?, ?, ?, ?
+            WHERE EXISTS (SELECT 1 FROM urls WHERE url = ? AND status = ?)
+            ON CONFLICT (url) DO UPDATE SET status = excluded.status, alias = excluded.alias, checked = excluded.checked
+            WHERE urls.status = ?
+        """, [(url, URL_ALIAS, alias, checked, alias, URL_SCRAPED, URL_PENDING)
+              for [url, alias, checked] in aliases if url_filter.match(url)])
+        frontier.execute("""
+            UPDATE urls SET depth = (SELECT depth FROM migrated_depths WHERE migrated_depths.url = urls.url)
+            WHERE url IN (SELECT url FROM migrated_depths)
+        """)
+        frontier.execute("DROP TABLE migrated_depths")
+        set_meta(frontier, 'filter', url_filter.pattern)
+        # priorities of pending URLs are lost, the next crawl computes them again by the policy
+        frontier.execute("DELETE FROM meta WHERE key = 'policy'")
+
+
+def restore_session(corpus, url_filter=None, migrate=False, quiet=False):
+    frontier = open_frontier(corpus.target_folder)
+    stored_filter = get_meta(frontier, 'filter')
+    if stored_filter is None:
+        migrate = True
+    elif url_filter and stored_filter != url_filter.pattern:
+        if not quiet:
+            log(f"URL filter changed: {stored_filter}")
+        migrate = True
+    if migrate:
+        migrate_corpus(frontier, corpus, url_filter or re.compile(r".*"), quiet)
+    return frontier
+
+
+def count_urls(frontier):
+    counts = dict(frontier.execute(
+        "SELECT status, COUNT(*) FROM urls GROUP BY status").fetchall())
+    return [counts.get(URL_PENDING, 0) + counts.get(URL_FETCHING, 0), counts.get(URL_SCRAPED, 0)]
+
+
+def insert_links(frontier, links):
+    # links are [url, depth, priority], known ones keep their depth and priority
+    cursor = frontier.executemany(
+        "INSERT OR IGNORE INTO urls (url, depth, priority) VALUES (?, ?, ?)", [tuple(link) for link in links])
+    return max(cursor.rowcount, 0)
+
+
+def add_pending_urls(frontier, links):
+    with frontier:
+        return insert_links(frontier, links)
+
+
+def reset_pending_url(frontier, url, priority=0):
+    with frontier:
+        frontier.execute("""
+            INSERT INTO urls (url, status, priority) VALUES (?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET status = excluded.status
+        """, (url, URL_PENDING, priority))
+
+
+def prioritise_pending_urls(frontier, get_priority):
+    rows = frontier.execute(
+        "SELECT url, depth FROM urls WHERE status = ?", (URL_PENDING,)).fetchall()
+    with frontier:
+        frontier.executemany(
+            "UPDATE urls SET priority = ? WHERE url = ?", [(get_priority(url, depth), url) for [url, depth] in rows])
+    return len(rows)
+
+
+def take_pending_urls(frontier, count):
+    # returns [url, depth] of pending URLs with the lowest priority
+    with frontier:
+        rows = frontier.execute(
+            "SELECT url, depth FROM urls WHERE status = ? ORDER BY priority LIMIT ?", (URL_PENDING, count)).fetchall()
+        frontier.executemany(
+            "UPDATE urls SET status = ? WHERE url = ?", [(URL_FETCHING, row[0]) for row in rows])
+    return rows
+
+
+def take_refresh_urls(frontier, started, count):
+    with frontier:
+        pages = frontier.execute("""
+            SELECT url, name, etag, modified, hash, depth FROM urls
+            WHERE status = ? AND (checked IS NULL OR checked < ?) LIMIT ?
+        """, (URL_SCRAPED, started, count)).fetchall()
+        frontier.executemany(
+            "UPDATE urls SET checked = ? WHERE url = ?", [(started, page[0]) for page in pages])
+    return pages
+
+
+def find_duplicate(frontier, url, simhash, max_distance):
+    # candidates share a band with the fingerprint, the closest one within the distance is the canonical page
+    bands = get_simhash_bands(simhash)
+    rows = frontier.execute(f"""
+        SELECT DISTINCT urls.url, urls.simhash FROM simhash_bands JOIN urls ON urls.url = simhash_bands.url
+        WHERE simhash_bands.band IN ({", ".join("?" * len(bands))}) AND urls.status = ? AND urls.url != ?
+    """, (*bands, URL_SCRAPED, url)).fetchall()
+    duplicates = [[get_distance(simhash, to_unsigned(row[1])), row[0]] for row in rows]
+    duplicates = [duplicate for duplicate in duplicates if duplicate[0] <= max_distance]
+    return min(duplicates)[1] if duplicates else None
+
+
+def save_simhash(frontier, url, simhash):
+    frontier.execute("DELETE FROM simhash_bands WHERE url = ?", (url,))
+    frontier.execute("UPDATE urls SET simhash = ? WHERE url = ?",
+                     (None if simhash is None else to_signed(simhash), url))
+    if simhash is not None:
+        frontier.executemany(
+            "INSERT OR IGNORE INTO simhash_bands (band, url) VALUES (?, ?)",
+            [(band, url) for band in get_simhash_bands(simhash)])
+
+
+def mark_scraped(frontier, url, name, links, etag=None, modified=None, text_hash=None, simhash=None):
+    with frontier:
+        frontier.execute("""
+            UPDATE urls SET name = ?, status = ?, etag = ?, modified = ?, hash = ?, checked = ?, changed = 1
+            WHERE url = ?
+        """, (name, URL_SCRAPED, etag, modified, text_hash, get_current_timestamp(), url))
+        save_simhash(frontier, url, simhash)
+        return insert_links(frontier, links)
+
+
+def mark_alias(frontier, url, canonical_url, links):
+    # links of an alias are followed, its content is the canonical page's one
+    with frontier:
+        frontier.execute(
+            "UPDATE urls SET status = ?, alias = ?, checked = ? WHERE url = ?",
+            (URL_ALIAS, canonical_url, get_current_timestamp(), url))
+        return insert_links(frontier, links)
+
+
+def mark_unchanged(frontier, url, etag=None, modified=None):
+    with frontier:
+        frontier.execute(
+            "UPDATE urls SET etag = ?, modified = ?, checked = ? WHERE url = ?",
+            (etag, modified, get_current_timestamp(), url))
+
+
+def mark_failed(frontier, url):
+    with frontier:
+        frontier.execute(
+            "UPDATE urls SET status = ? WHERE url = ?", (URL_FAILED, url))
+
+
+def mark_uploaded(frontier, url):
+    with frontier:
+        frontier.execute(
+            "UPDATE urls SET uploaded = 1, changed = 0 WHERE url = ?", (url,))
+
+
+def get_pending_uploads(frontier):
+    return frontier.execute(
+        "SELECT url, name FROM urls WHERE status = ? AND (uploaded = 0 OR changed = 1)", (URL_SCRAPED,)).fetchall()
+
+
+def reconcile_uploads(frontier, uploaded_urls, collection_id):
+    with frontier:
+        frontier.execute("UPDATE urls SET uploaded = 0 WHERE uploaded = 1")
+        frontier.executemany(
+            "UPDATE urls SET uploaded = 1 WHERE url = ?", [(url,) for url in uploaded_urls])
+        set_meta(frontier, 'collection', collection_id)
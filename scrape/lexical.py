@@ -0,0 +1,111 @@
+import os
+import re
+import sqlite3
+
+from util import *
+
+LEXICAL_FILE_NAME = "lexical.sqlite"
+# number of pages indexed per transaction when the index is built from scraped pages
+LEXICAL_BATCH_SIZE = 1000
+
+
+def open_lexical_index(target_folder, create=True):
+    # page texts are not stored in the full-text table, only their terms and positions,
+    # texts are read from the corpus when needed
+    path = os.path.join(target_folder, LEXICAL_FILE_NAME)
+    if not create and not os.path.exists(path):
+        return None
+    lexical_index = sqlite3.connect(path, check_same_thread=False)
+    lexical_index.execute("PRAGMA journal_mode = WAL")
+    lexical_index.execute("PRAGMA synchronous = NORMAL")
+    with lexical_index:
+        lexical_index.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS terms USING fts5 (
+                text,
+                content = '',
+                tokenize = 'porter unicode61 remove_diacritics 2'
+            )
+        """)
+        lexical_index.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                name TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                document INTEGER NOT NULL UNIQUE
+            ) WITHOUT ROWID
+        """)
+    return lexical_index
+
+
+def count_indexed_pages(lexical_index):
+    return lexical_index.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+
+def is_page_indexed(lexical_index, name):
+    return lexical_index.execute("SELECT 1 FROM pages WHERE name = ?", (name,)).fetchone() is not None
+
+
+def add_indexed_page(lexical_index, name, url, text, old_text=None):
+    row = lexical_index.execute(
+        "SELECT document FROM pages WHERE name = ?", (name,)).fetchone()
+    if row and old_text is not None:
+        # terms of a contentless table are removed by repeating the indexed text
+        lexical_index.execute(
+            "INSERT INTO terms (terms, rowid, text) VALUES ('delete', ?, ?)", (row[0], old_text))
+    # without the old text the previous terms stay, but are not joined to the page anymore
+    document = lexical_index.execute(
+        "INSERT INTO terms (text) VALUES (?)", (text,)).lastrowid
+    lexical_index.execute("""
+        INSERT INTO pages (name, url, document) VALUES (?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET url = excluded.url, document = excluded.document
+    """, (name, url, document))
+
+
+def index_page(lexical_index, name, url, text, old_text=None):
+    with lexical_index:
+        add_indexed_page(lexical_index, name, url, text, old_text)
+
+
+def build_lexical_index(lexical_index, corpus, quiet=False):
+    names = corpus.list_names()
+    if not quiet:
+        log(f"Building lexical index: {len(names)} pages")
+    indexed_count = 0
+    for index in range(0, len(names), LEXICAL_BATCH_SIZE):
+        with lexical_index:
+            for name in names[index:index + LEXICAL_BATCH_SIZE]:
+                try:
+                    add_indexed_page(lexical_index, name, corpus.read_json(name)["url"], corpus.read_text(name))
+                    indexed_count += 1
+                except:
+                    log(f"Failed to index page: {name}")
+    if not quiet:
+        log(f"Built lexical index: {indexed_count} pages")
+    return indexed_count
+
+
+def restore_lexical_index(corpus, quiet=False):
+    lexical_index = open_lexical_index(corpus.target_folder)
+    if count_indexed_pages(lexical_index) == 0 and corpus.list_names():
+        build_lexical_index(lexical_index, corpus, quiet)
+    return lexical_index
+
+
+def make_match_query(query_text):
+    # every word is a phrase of its tokens, so codes like ERR_CONN-42 match as a whole, any word may match
+    words = [word.replace('"', '""') for word in query_text.split() if re.search(r"\w", word)]
+    return " OR ".join(f'"{word}"' for word in words)
+
+
+def search_pages(lexical_index, query_text, limit):
+    # returns [url, name, score] ordered by BM25 score, higher is better
+    match_query = make_match_query(query_text)
+    if not match_query:
+        return []
+    rows = lexical_index.execute("""
+        SELECT pages.url, pages.name, -bm25(terms) AS score
+        FROM terms JOIN pages ON pages.document = terms.rowid
+        WHERE terms MATCH ?
+        ORDER BY bm25(terms)
+        LIMIT ?
+    """, (match_query, limit)).fetchall()
+    return [list(row) for row in rows]
@@ -0,0 +1,298 @@
+import bisect
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from util import *
+
+# upper bounds of latency buckets in seconds
+HISTOGRAM_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf")]
+METRICS_HOST = "127.0.0.1"
+METRICS_INTERVAL = 10
+METRICS_PREFIX = "ai_toolkit"
+PROFILE_INTERVAL = 0.01
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets, percentiles are estimated by bucket upper bounds,
+    percentiles in the overflow bucket by the last finite bound, as JSON has no infinity.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * len(HISTOGRAM_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, share):
+        rank = share * self.count
+        total = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS, self.buckets):
+            total += count
+            if total >= rank and total:
+                return min(bound, HISTOGRAM_BUCKETS[-2])
+        return None
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "sum": self.sum
+        }
+
+
+class Metrics:
+    """Counters, latency histograms and gauges of all stages, shared by the threads of one process."""
+
+    def __init__(self):
+        self.counters = collections.defaultdict(float)
+        self.gauges = {}
+        self.histograms = collections.defaultdict(Histogram)
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def reset(self):
+        # gauges stay, they belong to running loops
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started = time.time()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            self.histograms[name].observe(seconds)
+
+    def gauge(self, name, get_value):
+        # gauges are read when a snapshot is taken, e.g. queue depths
+        with self.lock:
+            self.gauges[name] = get_value
+
+    def read_gauges(self):
+        with self.lock:
+            gauges = list(self.gauges.items())
+        values = {}
+        for name, get_value in gauges:
+            try:
+                values[name] = get_value()
+            except:
+                values[name] = None
+        return values
+
+    def snapshot(self):
+        gauges = self.read_gauges()
+        with self.lock:
+            elapsed = time.time() - self.started
+            return {
+                "timestamp": time.time(),
+                "elapsed": elapsed,
+                "counters": dict(self.counters),
+                "rates": {name: value / elapsed for name, value in self.counters.items()} if elapsed else {},
+                "gauges": gauges,
+                "latency": {name: histogram.summary() for name, histogram in self.histograms.items()}
+            }
+
+    def to_prometheus(self):
+        gauges = self.read_gauges()
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                metric = make_metric_name(name) + "_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+            for name, histogram in sorted(self.histograms.items()):
+                metric = make_metric_name(name) + "_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                total = 0
+                for bound, count in zip(HISTOGRAM_BUCKETS, histogram.buckets):
+                    total += count
+                    lines.append(f'{metric}_bucket{{le="{"+Inf" if bound == float("inf") else bound}"}} {total}')
+                lines += [f"{metric}_sum {histogram.sum}", f"{metric}_count {histogram.count}"]
+        for name, value in sorted(gauges.items()):
+            if value is not None:
+                metric = make_metric_name(name)
+                lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def make_metric_name(name):
+    return f"{METRICS_PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+
+
+# metrics of this process, stages record to it directly
+METRICS = Metrics()
+
+
+def count_metric(name, value=1):
+    METRICS.count(name, value)
+
+
+def observe_metric(name, seconds):
+    METRICS.observe(name, seconds)
+
+
+def set_gauge(name, get_value):
+    METRICS.gauge(name, get_value)
+
+
+@contextmanager
+def timed(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.observe(name, time.perf_counter() - started)
+
+
+def measure_call(function, *args):
+    # for functions run in other processes, their metrics do not reach this one; returns [seconds, result]
+    started = time.perf_counter()
+    result = function(*args)
+    return [time.perf_counter() - started, result]
+
+
+def write_snapshot(path):
+    temporary_path = f"{path}.{os.getpid()}"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump(METRICS.snapshot(), file, indent=2)
+    os.replace(temporary_path, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] == "/metrics":
+            data = METRICS.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        else:
+            data = json.dumps(METRICS.snapshot()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SamplingProfiler:
+    """
+    Samples stacks of all threads of this process, which cProfile does not follow,
+    and writes them as collapsed stacks, one `frame;frame;frame count` line per stack, for flame graph tools.
+    """
+
+    def __init__(self, path, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.path = path
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        with open(self.path, "w", encoding="utf-8") as file:
+            for stack, samples in self.stacks.most_common():
+                file.write(f"{stack} {samples}\n")
+
+
+class MetricsReporter:
+    """Writes periodic JSON snapshots, serves the Prometheus endpoint and runs the profiler, as configured."""
+
+    def __init__(self, snapshot_path=None, interval=METRICS_INTERVAL, port=None, profile_path=None, quiet=False):
+        self.interval = interval
+        self.port = port
+        self.profiler = SamplingProfiler(profile_path) if profile_path else None
+        self.quiet = quiet
+        self.server = None
+        self.snapshot_path = snapshot_path
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.snapshot_path:
+            self.thread = threading.Thread(target=self.run, name="metrics", daemon=True)
+            self.thread.start()
+        if self.port:
+            self.server = ThreadingHTTPServer((METRICS_HOST, self.port), MetricsHandler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True).start()
+            if not self.quiet:
+                log(f"Serving metrics: http://{METRICS_HOST}:{self.port}/metrics")
+        if self.profiler:
+            self.profiler.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            write_snapshot(self.snapshot_path)
+        except:
+            log(f"Failed to write metrics: {self.snapshot_path}")
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.write()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.profiler:
+            self.profiler.stop()
+            if not self.quiet:
+                log(f"Wrote profile: {self.profiler.path}")
+
+
+def add_metrics_args(parser):
+    parser.add_argument(
+        "--metrics", help=f"path to the JSON file to write metrics snapshots to")
+    parser.add_argument(
+        "--metrics-interval", type=int, help=f"number of seconds between metrics snapshots, by default - {METRICS_INTERVAL}")
+    parser.add_argument(
+        "--metrics-port", type=int, help=f"port to serve metrics in Prometheus text format on, at /metrics")
+    parser.add_argument(
+        "--profile", help=f"path to the file to write sampled stacks of all threads to, in collapsed format")
+
+
+def handle_metrics_args(args):
+    interval = handle_count_arg(args, 'metrics_interval', METRICS_INTERVAL)
+    if not interval:
+        return None
+    return MetricsReporter(args.metrics, interval, args.metrics_port, args.profile, args.quiet)
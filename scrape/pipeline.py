@@ -0,0 +1,390 @@
+import argparse
+import queue
+import signal
+import threading
+import time
+
+import scrape
+import upload
+
+from scrape import *
+from upload import *
+
+CHUNK_WORKERS = 2
+UPSERT_WORKERS = 1
+# items waiting between two stages, a full queue holds the previous stage back
+QUEUE_SIZE = 64
+# seconds buffered records may wait for a full batch, so pages become queryable soon after they are fetched
+FLUSH_INTERVAL = 30
+# seconds workers wait for an item before checking for shutdown and due flushes
+QUEUE_TIMEOUT = 1
+
+# graceful shutdown, the flags of the scrape and upload modules are the ones their loops check
+
+
+def signal_handler(sig, frame):
+    log(" ...shutting down")
+    scrape.shutdown_requested = True
+    upload.shutdown_requested = True
+
+
+signal.signal(signal.SIGINT, signal_handler)
+signal.signal(signal.SIGTERM, signal_handler)
+
+# main logic
+
+
+def put_item(target_queue, item):
+    # blocks while the queue is full, unless shutting down, then the item is dropped;
+    # dropped pages stay scraped but not uploaded in the frontier and are uploaded by the next run
+    while not scrape.shutdown_requested:
+        try:
+            target_queue.put(item, timeout=QUEUE_TIMEOUT)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def start_stage(name, worker_count, input_queue, output_queue, process, keep_results=False):
+    # workers stop on None, one per worker, and skip queued items once shutdown was requested;
+    # kept results are handed over even then, e.g. analysed pages, which were paid for
+    def work():
+        while True:
+            item = input_queue.get()
+            if item is None:
+                return
+            if scrape.shutdown_requested:
+                continue
+            try:
+                result = process(item)
+            except:
+                log(f"Failed to process item in {name} stage: {item[0]}")
+                continue
+            if result is not None and output_queue is not None:
+                if keep_results and scrape.shutdown_requested:
+                    output_queue.put(result)
+                else:
+                    put_item(output_queue, result)
+    threads = [threading.Thread(target=work, name=f"{name}-{index}", daemon=True) for index in range(worker_count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def stop_stage(threads, input_queue):
+    for _ in threads:
+        input_queue.put(None)
+    for thread in threads:
+        thread.join()
+
+
+def make_chunk_stage(corpus, quiet):
+    token_limit = get_chunk_token_limit()
+
+    def chunk_page(item):
+        [target_url, target_name] = item
+        text = corpus.read_text(target_name)
+        with timed("chunk"):
+            chunks = extract_chunks(text, token_limit, quiet)
+        count_metric("chunk.chunks", len(chunks))
+        return [target_url, target_name, text, chunks]
+    return chunk_page
+
+
+def make_analyse_stage(scheduler, cache, corpus, quiet, packer=None):
+    def analyse_page(item):
+        [target_url, target_name, text, chunks] = item
+        results = analyse_document(scheduler, cache, target_name, target_url, text, quiet, chunks, packer)
+        if not results:
+            if results is not None:
+                log(f"Could not find content: {target_name}")
+            return None
+        document = corpus.read_json(target_name)
+        document["chunks"] = results
+        return [target_url, document]
+    return analyse_page
+
+
+class UploadRecorder:
+    """Saves upserted documents and marks them uploaded in the frontier, from any stage thread."""
+
+    def __init__(self, corpus, quiet=False):
+        self.corpus = corpus
+        self.failed_count = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.quiet = quiet
+        self.uploaded_count = 0
+
+    def get_frontier(self):
+        # SQLite connections are used by the thread that opened them
+        if not hasattr(self.local, "frontier"):
+            self.local.frontier = open_frontier(self.corpus.target_folder)
+        return self.local.frontier
+
+    def record(self, upserted, failed):
+        frontier = self.get_frontier()
+        for document in upserted:
+            if save_document(self.corpus, document, self.quiet):
+                mark_uploaded(frontier, document['url'])
+                count_metric("upload.documents")
+                with self.lock:
+                    self.uploaded_count += 1
+            else:
+                count_metric("upload.failed")
+                with self.lock:
+                    self.failed_count += 1
+        if failed:
+            count_metric("upload.failed", len(failed))
+        with self.lock:
+            self.failed_count += len(failed)
+        if (upserted or failed) and not self.quiet:
+            log(f"Uploading pages: {self.uploaded_count} uploaded, {self.failed_count} failed")
+
+    def close(self):
+        # closes the connection of the calling thread
+        if hasattr(self.local, "frontier"):
+            self.local.frontier.close()
+            del self.local.frontier
+
+
+def start_upsert_stage(worker_count, input_queue, writer, recorder, index_mode, flush_interval):
+    # besides upserting full batches, workers flush records waiting longer than the flush interval
+    last_flush = [time.monotonic()]
+
+    def work():
+        while True:
+            try:
+                item = input_queue.get(timeout=QUEUE_TIMEOUT)
+            except queue.Empty:
+                item = False
+            if item is None:
+                recorder.close()
+                return
+            # analysed pages are upserted on shutdown as well
+            if item:
+                [_, document] = item
+                recorder.record(*writer.add(make_records(document, index_mode), document))
+            if writer.pending() and time.monotonic() - last_flush[0] >= flush_interval:
+                last_flush[0] = time.monotonic()
+                recorder.record(*writer.flush())
+    threads = [threading.Thread(target=work, name=f"upsert-{index}", daemon=True) for index in range(worker_count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def feed_pending_uploads(pending_uploads, chunk_queue):
+    for item in pending_uploads:
+        if not put_item(chunk_queue, item):
+            return
+
+
+def run_pipeline(base_url, corpus, chroma_collection, writer, scheduler, cache, url_filter, document_limit=scrape.DOCUMENT_LIMIT,
+                 concurrency=CONCURRENCY, host_concurrency=HOST_CONCURRENCY, workers=WORKERS,
+                 chunk_workers=CHUNK_WORKERS, analyse_workers=SCHEDULER_CONCURRENCY, upsert_workers=UPSERT_WORKERS,
+                 queue_size=QUEUE_SIZE, flush_interval=FLUSH_INTERVAL, index_mode=INDEX_MODE,
+                 similarity=SIMILARITY_THRESHOLD, policy=CRAWL_POLICY, boosts=[], sitemap=False, quiet=False, packer=None):
+    frontier = restore_session(corpus, url_filter, quiet=quiet)
+    restore_uploads(frontier, chroma_collection, quiet=quiet)
+    chunk_queue = queue.Queue(queue_size)
+    analyse_queue = queue.Queue(queue_size)
+    upsert_queue = queue.Queue(queue_size)
+    set_gauge("pipeline.chunk_queue", chunk_queue.qsize)
+    set_gauge("pipeline.analyse_queue", analyse_queue.qsize)
+    set_gauge("pipeline.upsert_queue", upsert_queue.qsize)
+    set_gauge("pipeline.buffered", writer.pending)
+    recorder = UploadRecorder(corpus, quiet)
+    chunk_threads = start_stage("chunk", chunk_workers, chunk_queue, analyse_queue, make_chunk_stage(corpus, quiet))
+    # pages of packed chunks wait for their packs, more of them are analysed at once to fill the packs
+    analyse_threads = start_stage(
+        "analyse", analyse_workers * (packer.size_limit if packer else 1), analyse_queue, upsert_queue,
+        make_analyse_stage(scheduler, cache, corpus, quiet, packer), True)
+    upsert_threads = start_upsert_stage(upsert_workers, upsert_queue, writer, recorder, index_mode, flush_interval)
+    # pages scraped by earlier runs but not uploaded yet are fed alongside the crawl
+    pending_uploads = [[url, name] for [url, name] in get_pending_uploads(frontier) if url_filter.match(url)]
+    frontier.close()
+    if not quiet:
+        log(f"Uploading pages scraped before: {len(pending_uploads)} pending")
+    feeder = threading.Thread(target=feed_pending_uploads, args=(pending_uploads, chunk_queue), daemon=True)
+    feeder.start()
+    try:
+        # the crawl runs in this thread, every written page is handed over to the chunk stage
+        scrape_url(base_url, corpus, url_filter, document_limit, concurrency, host_concurrency, workers,
+                   False, False, similarity, policy, boosts, sitemap,
+                   lambda target_url, target_name: put_item(chunk_queue, [target_url, target_name]), quiet)
+    finally:
+        if scrape.shutdown_requested:
+            # requests waiting for rate limits fail fast, their pages are uploaded by the next run
+            scheduler.stop()
+        feeder.join()
+        stop_stage(chunk_threads, chunk_queue)
+        if packer:
+            # chunks left in the last pack are sent without waiting
+            packer.flush()
+        stop_stage(analyse_threads, analyse_queue)
+        stop_stage(upsert_threads, upsert_queue)
+        # buffered records are upserted on shutdown as well
+        recorder.record(*writer.flush())
+        recorder.close()
+        if not quiet:
+            log(f"Uploaded pages: {recorder.uploaded_count} uploaded, {recorder.failed_count} failed")
+
+# entry point
+
+
+def main(args):
+    target_folder = handle_folder_arg(args)
+    chroma_collection = handle_chroma_arg(args)
+    document_limit = handle_limit_arg(args, scrape.DOCUMENT_LIMIT)
+    concurrency = handle_count_arg(args, 'concurrency', CONCURRENCY)
+    workers = handle_count_arg(args, 'workers', WORKERS)
+    chunk_workers = handle_count_arg(args, 'chunk_workers', CHUNK_WORKERS)
+    analyse_workers = handle_count_arg(args, 'analyse_workers', SCHEDULER_CONCURRENCY)
+    upsert_workers = handle_count_arg(args, 'upsert_workers', UPSERT_WORKERS)
+    queue_size = handle_count_arg(args, 'queue_size', QUEUE_SIZE)
+    flush_interval = handle_count_arg(args, 'flush_interval', FLUSH_INTERVAL)
+    request_limit = handle_count_arg(args, 'rpm', SCHEDULER_REQUEST_LIMIT)
+    token_limit = handle_count_arg(args, 'tpm', SCHEDULER_TOKEN_LIMIT)
+    cache_size = handle_count_arg(args, 'cache_size', CHAT_CACHE_SIZE)
+    batch_size = handle_count_arg(args, 'batch_size', UPSERT_BATCH_SIZE)
+    batch_tokens = handle_count_arg(args, 'batch_tokens', UPSERT_TOKEN_LIMIT)
+    boosts = handle_boost_arg(args)
+    similarity = None if args.no_dedup else handle_similarity_arg(args, SIMILARITY_THRESHOLD, SIMILARITY_LIMIT)
+    [base_url, parsed_url] = handle_url_arg(args)
+    metrics_reporter = handle_metrics_args(args)
+    url_filter = None
+    if parsed_url:
+        netloc = re.escape(parsed_url.netloc)
+        scheme = re.escape(parsed_url.scheme)
+        url_filter = handle_filter_arg(args, fr"^{scheme}://{netloc}(?:[^/]+/)*[^.]+(?:\.html?)?$")
+    storage = handle_storage_arg(args, target_folder) if target_folder else None
+    if not target_folder or not storage or not chroma_collection or not document_limit or not concurrency or not workers \
+            or not chunk_workers or not analyse_workers or not upsert_workers or not queue_size or not flush_interval \
+            or not request_limit or not token_limit or not cache_size or not batch_size or not batch_tokens or boosts is None or (similarity is None and not args.no_dedup) \
+            or not parsed_url or not url_filter or not metrics_reporter:
+        sys.exit(1)
+    import openai
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    if args.api_base:
+        openai.api_base = args.api_base
+    corpus = open_corpus(target_folder, storage, args.compress)
+    scheduler = Scheduler(analyse_workers, request_limit, token_limit, args.retries, args.quiet)
+    writer = ChromaWriter(chroma_collection, batch_size, batch_tokens,
+                          get_version_path(args.chroma, chroma_collection.name), args.quiet)
+    cache = None
+    if not args.no_cache:
+        cache = DiskCache(args.cache or os.path.join(target_folder, CHAT_CACHE_FILE_NAME), cache_size * 1024 * 1024)
+    packer = ChunkPacker(scheduler, quiet=args.quiet) if args.pack else None
+    log(f"Ready to scrape and upload web pages using args:")
+    log(f"  Initial page URL: {base_url}")
+    log(f"  Path to target folder: {target_folder}")
+    log(f"  Path to Chroma DB: {args.chroma}")
+    log(f"  URL filter: {url_filter}")
+    log(f"  Document limit: {document_limit}")
+    log(f"  Workers: {concurrency} fetch, {workers} parse, {chunk_workers} chunk, {analyse_workers} analyse, {upsert_workers} upsert")
+    log(f"  Queues: {queue_size} items, flushed every {flush_interval}s")
+    log(f"  Upsert batches: {batch_size} records, {batch_tokens} tokens")
+    log(f"  Index mode: {args.index}")
+    log(f"  Chat GPT cache: {'disabled' if cache is None else f'{cache_size} MB'}")
+    log(f"  Small chunks packing: {'enabled' if packer else 'disabled'}")
+    thread = threading.Thread(
+        target=run_pipeline,
+        args=(base_url, corpus, chroma_collection, writer, scheduler, cache, re.compile(url_filter), document_limit,
+              concurrency, args.host_concurrency or HOST_CONCURRENCY, workers, chunk_workers, analyse_workers, upsert_workers,
+              queue_size, flush_interval, args.index, similarity, args.policy, boosts, args.sitemap, args.quiet, packer)
+    )
+    thread.daemon = True
+    metrics_reporter.start()
+    thread.start()
+    thread.join()
+    if packer:
+        packer.close()
+    scheduler.shutdown()
+    metrics_reporter.stop()
+    if cache:
+        cache.close()
+    corpus.close()
+    log("Bye!")
+
+
+if __name__ == "__main__":
+    if os.getenv("OPENAI_API_KEY") is None:
+        log("OPENAI_API_KEY is not set!")
+        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="""
+          I can scrape web pages, summarize them with Chat GPT and upload summaries to Chroma DB, all at once.
+          Just tell me the URL of the initial web page, the path to the data folder and the path to Chroma DB folder.
+          Your OPENAI_API_KEY needs to be set in env vars to talk to Chat GPT.
+          Enjoy!
+        """)
+    parser.add_argument(
+        "url", help="URL of the initial page to scrape")
+    parser.add_argument(
+        "folder", help="path to the data folder")
+    parser.add_argument(
+        "chroma", help="path to the Chroma DB folder")
+    parser.add_argument(
+        "-f", "--filter", help="optional regex filtering links found on scrapped pages, by default - base URL of the initial page")
+    parser.add_argument(
+        "-l", "--limit", type=int, help=f"maximum number of URLs to fetch, by default - {scrape.DOCUMENT_LIMIT}")
+    parser.add_argument(
+        "-c", "--concurrency", type=int, help=f"maximum number of pages fetched in parallel, by default - {CONCURRENCY}")
+    parser.add_argument(
+        "--host-concurrency", type=int, help=f"maximum number of pages fetched in parallel from one host, by default - {HOST_CONCURRENCY}")
+    parser.add_argument(
+        "-w", "--workers", type=int, help=f"number of processes parsing fetched pages, by default - number of CPUs ({WORKERS})")
+    parser.add_argument(
+        "--chunk-workers", type=int, help=f"number of threads splitting pages into chunks, by default - {CHUNK_WORKERS}")
+    parser.add_argument(
+        "--analyse-workers", type=int, help=f"maximum number of Chat GPT requests in parallel, by default - {SCHEDULER_CONCURRENCY}")
+    parser.add_argument(
+        "--upsert-workers", type=int, help=f"number of threads upserting records to Chroma DB, by default - {UPSERT_WORKERS}")
+    parser.add_argument(
+        "--queue-size", type=int, help=f"maximum number of pages waiting between two stages, by default - {QUEUE_SIZE}")
+    parser.add_argument(
+        "--flush-interval", type=int, help=f"maximum number of seconds records wait for a full batch, by default - {FLUSH_INTERVAL}")
+    parser.add_argument(
+        "-s", "--storage", choices=CORPUS_STORAGES, help=f"format of scraped pages, by default - format of pages already in the data folder or files")
+    parser.add_argument(
+        "-z", "--compress", action="store_true", help=f"compress records of new segments, with segments storage")
+    parser.add_argument(
+        "-p", "--policy", choices=list(CRAWL_POLICIES), default=CRAWL_POLICY, help=f"order of pending pages, by link depth or by URL path length, by default - {CRAWL_POLICY}")
+    parser.add_argument(
+        "-b", "--boost", action="append", help=f"regex of URLs scraped before all others, may be repeated")
+    parser.add_argument(
+        "--sitemap", action="store_true", help=f"add pages listed in sitemaps of the site, found in robots.txt or sitemap.xml")
+    parser.add_argument(
+        "--similarity", type=float, help=f"similarity of page texts above which pages are near-duplicates, above {SIMILARITY_LIMIT}, by default - {SIMILARITY_THRESHOLD}")
+    parser.add_argument(
+        "--no-dedup", action="store_true", help=f"keep near-duplicate pages")
+    parser.add_argument(
+        "-i", "--index", choices=INDEX_MODES, default=INDEX_MODE, help=f"index whole pages or every chunk and question/answer pair as separate records, by default - {INDEX_MODE}")
+    parser.add_argument(
+        "--rpm", type=int, help=f"maximum number of Chat GPT requests per minute, by default - {SCHEDULER_REQUEST_LIMIT}")
+    parser.add_argument(
+        "--tpm", type=int, help=f"maximum number of Chat GPT tokens per minute, by default - {SCHEDULER_TOKEN_LIMIT}")
+    parser.add_argument(
+        "--retries", type=int, default=SCHEDULER_RETRIES, help=f"number of retries of failed Chat GPT requests, by default - {SCHEDULER_RETRIES}")
+    parser.add_argument(
+        "--pack", action="store_true", help=f"pack small chunks of several pages into shared Chat GPT requests, up to {PACK_SIZE} chunks each")
+    parser.add_argument(
+        "--cache", help="optional path to the cache of Chat GPT results, by default - cache.sqlite in the data folder")
+    parser.add_argument(
+        "--batch-size", type=int, help=f"maximum number of records upserted to Chroma DB at once, by default - {UPSERT_BATCH_SIZE}")
+    parser.add_argument(
+        "--batch-tokens", type=int, help=f"maximum number of tokens upserted to Chroma DB at once, by default - {UPSERT_TOKEN_LIMIT}")
+    parser.add_argument(
+        "--cache-size", type=int, help=f"maximum size of the cache of Chat GPT results in MB, by default - {CHAT_CACHE_SIZE}")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="do not cache Chat GPT results")
+    parser.add_argument(
+        "--api-base", help="optional base URL of OpenAI compatible API, e.g. a local test server")
+    add_embedding_args(parser)
+    add_metrics_args(parser)
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help=f"suppress logging to stdout")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,84 @@
+import re
+import xml.etree.ElementTree as ElementTree
+
+from urllib.parse import urljoin, urlparse
+
+from util import *
+
+# pending URLs with the lowest priority are fetched first
+CRAWL_POLICIES = {
+    # breadth first, pages closer to the initial page first
+    "bfs": lambda url, depth: depth,
+    # pages with shorter URL paths first, e.g. sections before their archives
+    "path": lambda url, depth: len([part for part in urlparse(url).path.split("/") if part]) + len(url) / 10000,
+}
+CRAWL_POLICY = "bfs"
+# priority subtracted from pages matching a boost pattern, more than any policy gives
+BOOST_PRIORITY = 1000
+SITEMAP_DEPTH = 1
+# sitemap files read when sitemaps are nested in sitemap indexes
+SITEMAP_FILE_LIMIT = 100
+SITEMAP_TIMEOUT = 30
+
+
+def make_priority(policy=CRAWL_POLICY, boosts=[]):
+    get_policy_priority = CRAWL_POLICIES[policy]
+    boost_patterns = [re.compile(boost) for boost in boosts]
+
+    def get_priority(url, depth):
+        priority = get_policy_priority(url, depth)
+        if any(pattern.search(url) for pattern in boost_patterns):
+            priority -= BOOST_PRIORITY
+        return priority
+
+    return get_priority
+
+
+def get_policy_key(policy, boosts):
+    # pending URLs are prioritised again when the key stored with the session differs
+    return "\n".join([policy, *boosts])
+
+
+def read_sitemap_locations(session, sitemap_url, quiet):
+    try:
+        response = session.get(sitemap_url, timeout=SITEMAP_TIMEOUT)
+        response.raise_for_status()
+        root = ElementTree.fromstring(response.content)
+    except:
+        if not quiet:
+            log(f"Failed to read sitemap: {sitemap_url}")
+        return [False, []]
+    # tags are namespaced, sitemap indexes list sitemaps, sitemaps list pages
+    locations = [element.text.strip() for element in root.iter() if element.tag.endswith("loc") and element.text]
+    return [root.tag.endswith("sitemapindex"), locations]
+
+
+def find_sitemaps(session, base_url, quiet):
+    sitemap_urls = []
+    try:
+        response = session.get(urljoin(base_url, "/robots.txt"), timeout=SITEMAP_TIMEOUT)
+        if response.ok:
+            for line in response.text.splitlines():
+                [key, _, value] = line.partition(":")
+                if key.strip().lower() == "sitemap" and value.strip():
+                    sitemap_urls.append(value.strip())
+    except:
+        if not quiet:
+            log(f"Failed to read robots.txt: {base_url}")
+    return sitemap_urls or [urljoin(base_url, "/sitemap.xml")]
+
+
+def fetch_sitemap_urls(session, base_url, quiet=False):
+    page_urls = []
+    sitemap_urls = find_sitemaps(session, base_url, quiet)
+    read_count = 0
+    while sitemap_urls and read_count < SITEMAP_FILE_LIMIT:
+        [is_index, locations] = read_sitemap_locations(session, sitemap_urls.pop(0), quiet)
+        read_count += 1
+        if is_index:
+            sitemap_urls.extend(locations)
+        else:
+            page_urls.extend(locations)
+    if not quiet:
+        log(f"Read sitemaps: {read_count} files, {len(page_urls)} pages")
+    return page_urls
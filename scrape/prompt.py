@@ -1,11 +1,14 @@
+SYSTEM_CONTENT = """
+You are AI consultant helping end users in achieving their goals using software products developed by the Corporation.
+Be concise, precise and informative, try to instruct the users, always stay within provided context.
+            """
+
+
 def make_summary_dialog(content):
     return [
         {
             "role": "system",
-            "content": """
-You are AI consultant helping end users in achieving their goals using software products developed by the Corporation.
-Be concise, precise and informative, try to instruct the users, always stay within provided context.
-            """
+            "content": SYSTEM_CONTENT
         },
         {
             "role": "user",
@@ -31,3 +34,45 @@ Format result as json based on template:
 """
         },
     ]
+
+
+def format_packed_article(number, content):
+    return f"""
+Article {number}:
+```text
+{content}
+```
+"""
+
+
+def make_packed_summary_dialog(articles):
+    # articles are formatted with format_packed_article, several small articles share the system prompt and instructions
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_CONTENT
+        },
+        {
+            "role": "user",
+            "content": f"""
+Use these numbered articles from the corporate knowledge base as context, every article separately.
+{articles}
+            """
+        },
+        {
+            "role": "user",
+            "content": """
+Generate for every article:
+* decent number of how-to end-user questions about the product and its use-case described in the article;
+* same number of detailed answers to the generated questions, based on the article only.
+Format result as json object with article numbers as keys based on template:
+```json
+{
+    "1": {
+        "questions": [],
+        "answers": [],
+    },
+}
+"""
+        },
+    ]
@@ -1,62 +1,546 @@
 import argparse
+import json
+import os
 import sys
+import threading
+import time
 
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlparse
+
+from cache import *
+from corpus import open_corpus
+from lexical import count_indexed_pages, open_lexical_index, search_pages
+from metrics import *
 from util import *
+from writer import get_version_path, read_collection_version
 
 DOCUMENT_LIMIT = 3
+QUERY_CACHE_FILE_NAME = "queries.sqlite"
+QUERY_CACHE_SIZE = 64
+QUERY_CACHE_TTL = 3600
+INCLUDE_FIELDS = ["distances", "documents", "metadatas"]
+# pages found by the lexical index per requested document, vector search ranks only them in hybrid mode
+LEXICAL_CANDIDATE_FACTOR = 10
+# rank constant of reciprocal rank fusion, damps the weight of the top ranks
+FUSION_RANK_CONSTANT = 60
+QUERY_MODES = ["vector", "lexical", "hybrid"]
+QUERY_MODE = "vector"
+QUERY_BATCH_SIZE = 64
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+# records fetched per page when hits are grouped by page, chunks of one page tend to match together
+GROUP_FACTOR = 5
 
 # main logic
 
 
-def query_chroma_db(chroma_collection, query_text, document_limit=DOCUMENT_LIMIT, quiet=True):
-    try:
-        include = ["distances"]
-        if quiet == False:
-            include.append("documents")
-            include.append("metadatas")
+def make_hits(results, index):
+    hits = []
+    for position, id in enumerate(results["ids"][index]):
+        hit = {"id": id}
+        for [field, name] in [["distances", "distance"], ["documents", "document"], ["metadatas", "metadatas"]]:
+            if results.get(field):
+                hit[name] = results[field][index][position]
+        hit["url"] = (hit.get("metadatas") or {}).get("url", id.split("#")[0])
+        hits.append(hit)
+    return hits
+
+
+def group_hits(hits, document_limit):
+    # hits come ordered by distance, the first hit of a page is the closest one
+    pages = {}
+    for hit in hits:
+        page = pages.get(hit["url"])
+        if page is None:
+            if len(pages) >= document_limit:
+                continue
+            pages[hit["url"]] = {**hit, "id": hit["url"], "hits": 1}
+            continue
+        page["hits"] += 1
+        if "document" in hit:
+            page["document"] += "\n---\n" + hit["document"]
+    return list(pages.values())
+
+
+class QueryCache:
+    """
+    Query results in a disk cache keyed by normalised query text and query options,
+    valid until their TTL passes or the collection version changes with the next upload.
+    """
+
+    def __init__(self, path, size_limit, ttl, version_path):
+        self.cache = DiskCache(path, size_limit)
+        self.hits = 0
+        self.lock = threading.Lock()
+        self.misses = 0
+        self.stale = 0
+        self.ttl = ttl
+        self.version_path = version_path
+
+    def make_key(self, collection_name, query_text, document_limit, include, group, where=None):
+        text = normalise_whitespace(query_text).casefold()
+        return make_cache_key(collection_name, text, document_limit, sorted(include), group, where)
+
+    def version(self):
+        return read_collection_version(self.version_path)
+
+    def get(self, key, version):
+        value = self.cache.get_json(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                count_metric("query.cache_misses")
+                return None
+            if value["version"] != version or time.time() - value["stored"] > self.ttl:
+                self.stale += 1
+                count_metric("query.cache_stale")
+                return None
+            self.hits += 1
+            count_metric("query.cache_hits")
+            return value["hits"]
+
+    def set(self, key, version, hits):
+        # the version read before the query is stored, so an upload during the query invalidates the result
+        self.cache.set_json(key, {"hits": hits, "stored": time.time(), "version": version})
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses + self.stale
+            return {
+                "hits": self.hits,
+                "hit_rate": self.hits / total if total else 0,
+                "misses": self.misses,
+                "stale": self.stale,
+                **{key: value for key, value in self.cache.stats().items() if key in ["entries", "size"]}
+            }
+
+    def close(self):
+        self.cache.close()
+
+
+def query_collection(chroma_collection, query_texts, document_limit, include, group, where=None):
+    # all texts are embedded and searched in one call, results come back per text
+    with timed("query.vector"):
         results = chroma_collection.query(
             include=include,
-            n_results=document_limit,
-            query_texts=[query_text],
+            n_results=document_limit * GROUP_FACTOR if group else document_limit,
+            query_texts=query_texts,
+            where=where,
         )
-        if not results["ids"]:
-            return
-        for index, ids in enumerate(results["ids"]):
-            if not ids:
-                continue
-            id = ids[0]
-            if quiet == False:
-                distance = results["distances"][index][0]
-                document = results["documents"][index][0]
-                metadatas = results["metadatas"][index][0]
-                links = len(metadatas.get("link_urls", "").split("\n"))
-                updated = metadatas.get("updated")
-                print(f"""
-Distance: {distance}
-Url: {id}
+    batch_hits = [make_hits(results, index) for index in range(len(results["ids"]))]
+    return [group_hits(hits, document_limit) if group else hits for hits in batch_hits]
+
+
+def search_chroma_db_batch(chroma_collection, query_texts, document_limit=DOCUMENT_LIMIT, include=["distances"], group=False, query_cache=None, lexical_search=None, where=None):
+    # query latency is measured per call, a single query when serving, a whole batch in batch mode
+    count_metric("query.texts", len(query_texts))
+    with timed("query"):
+        return search_texts(chroma_collection, query_texts, document_limit, include, group, query_cache, lexical_search, where)
+
+
+def search_texts(chroma_collection, query_texts, document_limit, include, group, query_cache, lexical_search, where):
+    if lexical_search:
+        return [lexical_search.search(chroma_collection, text, document_limit, include, query_cache) for text in query_texts]
+    if query_cache is None:
+        return query_collection(chroma_collection, query_texts, document_limit, include, group, where)
+    version = query_cache.version()
+    keys = [query_cache.make_key(chroma_collection.name, text, document_limit, include, group, where) for text in query_texts]
+    batch_hits = [query_cache.get(key, version) for key in keys]
+    missing = [index for index, hits in enumerate(batch_hits) if hits is None]
+    if missing:
+        missing_hits = query_collection(
+            chroma_collection, [query_texts[index] for index in missing], document_limit, include, group, where)
+        for index, hits in zip(missing, missing_hits):
+            batch_hits[index] = hits
+            query_cache.set(keys[index], version, hits)
+    return batch_hits
+
+
+def search_chroma_db(chroma_collection, query_text, document_limit=DOCUMENT_LIMIT, include=["distances"], group=False, query_cache=None, lexical_search=None):
+    batch_hits = search_chroma_db_batch(chroma_collection, [query_text], document_limit, include, group, query_cache, lexical_search)
+    return batch_hits[0] if batch_hits else []
+
+
+class LexicalSearch:
+    """
+    Searches pages in the BM25 index of the data folder, without embedding the query,
+    or, in hybrid mode, narrows vector search to pages found by the index and fuses both rankings.
+    Hybrid mode needs records with `url` metadata, uploaded since chunk indexing was added.
+    """
+
+    def __init__(self, lexical_index, corpus, hybrid=False):
+        self.corpus = corpus
+        self.hybrid = hybrid
+        self.lexical_index = lexical_index
+        self.lock = threading.Lock()
+
+    def find_pages(self, query_text, limit):
+        with self.lock, timed("query.lexical"):
+            return search_pages(self.lexical_index, query_text, limit)
+
+    def make_hit(self, url, name, include):
+        hit = {"id": url, "url": url}
+        if "documents" in include:
+            try:
+                hit["document"] = self.corpus.read_text(name)
+            except:
+                hit["document"] = None
+        if "metadatas" in include:
+            hit["metadatas"] = {"name": name, "url": url}
+        return hit
+
+    def search(self, chroma_collection, query_text, document_limit, include, query_cache=None):
+        if not self.hybrid:
+            hits = []
+            for [url, name, score] in self.find_pages(query_text, document_limit):
+                hits.append({**self.make_hit(url, name, include), "score": score})
+            return hits
+        pages = self.find_pages(query_text, document_limit * LEXICAL_CANDIDATE_FACTOR)
+        if not pages:
+            # nothing matches literally, the query may still match by meaning
+            return search_chroma_db(chroma_collection, query_text, document_limit, include, True, query_cache)
+        vector_hits = search_chroma_db_batch(
+            chroma_collection, [query_text], len(pages), include, True, query_cache,
+            where={"url": {"$in": [url for [url, _, _] in pages]}})[0]
+        return fuse_hits(pages, vector_hits, document_limit, lambda url, name: self.make_hit(url, name, include))
+
+    def close(self):
+        self.lexical_index.close()
+        self.corpus.close()
+
+
+def fuse_hits(pages, vector_hits, document_limit, make_hit):
+    # reciprocal rank fusion, scores of both rankers are not comparable, their ranks are
+    scores = {}
+    names = {}
+    for rank, [url, name, _] in enumerate(pages):
+        scores[url] = 1 / (FUSION_RANK_CONSTANT + rank + 1)
+        names[url] = name
+    hits = {}
+    for rank, hit in enumerate(vector_hits):
+        scores[hit["url"]] = scores.get(hit["url"], 0) + 1 / (FUSION_RANK_CONSTANT + rank + 1)
+        hits[hit["url"]] = hit
+    urls = sorted(scores, key=lambda url: scores[url], reverse=True)[:document_limit]
+    return [{**(hits.get(url) or make_hit(url, names[url])), "score": scores[url]} for url in urls]
+
+
+def print_hit(hit, quiet):
+    if quiet:
+        print(hit["id"])
+        return
+    metadatas = hit.get("metadatas") or {}
+    links = len(metadatas.get("link_urls", "").split("\n"))
+    updated = metadatas.get("updated")
+    print(f"""
+{f'Score: {hit["score"]}' if "score" in hit else f'Distance: {hit.get("distance")}'}
+Url: {hit["id"]}
 
 Document:
-{document}
+{hit.get("document")}
 
 Metadatas:
 links: {links}
 updated: {updated}
                 """)
-            else:
-                print(id)
+
+
+def query_chroma_db(chroma_collection, query_text, document_limit=DOCUMENT_LIMIT, group=False, query_cache=None, lexical_search=None, quiet=True):
+    try:
+        include = ["distances"]
+        if quiet == False:
+            include.append("documents")
+            include.append("metadatas")
+        for hit in search_chroma_db(chroma_collection, query_text, document_limit, include, group, query_cache, lexical_search):
+            print_hit(hit, quiet)
     except:
         log("Failed to query Chroma DB")
 
+# batch queries
+
+
+def parse_query(line, document_limit, include, group):
+    # a line is either plain query text or a JSON object with text and optional id, n_results, include and group
+    query = json.loads(line) if line.startswith("{") else {"text": line}
+    text = query.get("text")
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("Query has no text")
+    query_limit = int(query.get("n_results", document_limit))
+    if query_limit <= 0:
+        raise ValueError(f"Query n_results is not positive: {query_limit}")
+    fields = query.get("include", include)
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    for field in fields:
+        if field not in INCLUDE_FIELDS:
+            raise ValueError(f"Query include field is not valid: {field}")
+    return {
+        "group": bool(query.get("group", group)),
+        "id": query.get("id"),
+        "include": sorted(set(fields)),
+        "n_results": query_limit,
+        "text": text
+    }
+
+
+def make_query_record(line_number, query, **fields):
+    record = {"line": line_number}
+    if query.get("id") is not None:
+        record["id"] = query["id"]
+    if "text" in query:
+        record["query"] = query["text"]
+    record.update(fields)
+    return record
+
+
+def run_query_batch(chroma_collection, batch, output_file, query_cache=None, lexical_search=None):
+    # Chroma takes one n_results and include per call, so queries are grouped by them
+    records = {}
+    groups = {}
+    for [line_number, query] in batch:
+        if "error" in query:
+            records[line_number] = make_query_record(line_number, query, error=query["error"])
+            continue
+        key = (query["n_results"], tuple(query["include"]), query["group"])
+        groups.setdefault(key, []).append([line_number, query])
+    for [[document_limit, include, group], queries] in groups.items():
+        try:
+            batch_hits = search_chroma_db_batch(
+                chroma_collection, [query["text"] for [_, query] in queries], document_limit, list(include), group, query_cache, lexical_search)
+            for [[line_number, query], hits] in zip(queries, batch_hits):
+                records[line_number] = make_query_record(line_number, query, results=hits)
+        except Exception as e:
+            log(f"Failed to query Chroma DB: {len(queries)} queries, {str(e)}")
+            for [line_number, query] in queries:
+                records[line_number] = make_query_record(line_number, query, error="Failed to query Chroma DB")
+    # records are written in input order as soon as their batch completes
+    for line_number in sorted(records):
+        output_file.write(json.dumps(records[line_number], ensure_ascii=False) + "\n")
+    output_file.flush()
+    return sum(1 for record in records.values() if "error" in record)
+
+
+def query_chroma_db_batch(chroma_collection, input_file, output_file, document_limit=DOCUMENT_LIMIT, include=INCLUDE_FIELDS, group=False, batch_size=QUERY_BATCH_SIZE, query_cache=None, lexical_search=None, quiet=False):
+    # only one batch of queries and their results is held in memory
+    batch = []
+    query_count = 0
+    failed_count = 0
+    for line_number, line in enumerate(input_file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            batch.append([line_number, parse_query(line, document_limit, include, group)])
+        except Exception as e:
+            batch.append([line_number, {"error": f"Query is not valid: {str(e)}"}])
+        if len(batch) >= batch_size:
+            failed_count += run_query_batch(chroma_collection, batch, output_file, query_cache, lexical_search)
+            query_count += len(batch)
+            batch = []
+            if not quiet:
+                log(f"Queries answered: {query_count}, failed: {failed_count}")
+    if batch:
+        failed_count += run_query_batch(chroma_collection, batch, output_file, query_cache, lexical_search)
+        query_count += len(batch)
+    if not quiet:
+        log(f"Queries answered: {query_count}, failed: {failed_count}")
+    return [query_count, failed_count]
+
+# query server
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Answers `GET /query?text=...&limit=...&group=1` and `POST /query` with a JSON body of the same fields,
+    with `{"results": [...]}`, `GET /health` with the number of records in the collection
+    and `GET /stats` with query cache statistics.
+    """
+
+    chroma_collection = None
+    lexical_search = None
+    query_cache = None
+    quiet = False
+
+    def do_GET(self):
+        request = urlparse(self.path)
+        if request.path == "/health":
+            if self.chroma_collection is None:
+                self.send_json(200, {"count": count_indexed_pages(self.lexical_search.lexical_index)})
+            else:
+                self.send_json(200, {"count": self.chroma_collection.count()})
+        elif request.path == "/stats":
+            self.send_json(200, {"cache": self.query_cache.stats() if self.query_cache else None, "metrics": METRICS.snapshot()})
+        elif request.path == "/metrics":
+            data = METRICS.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif request.path == "/query":
+            self.handle_query({key: values[-1] for key, values in parse_qs(request.query).items()})
+        else:
+            self.send_json(404, {"error": f"Not found: {request.path}"})
+
+    def do_POST(self):
+        request = urlparse(self.path)
+        if request.path != "/query":
+            self.send_json(404, {"error": f"Not found: {request.path}"})
+            return
+        try:
+            query = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except Exception:
+            self.send_json(400, {"error": "Request body is not valid JSON"})
+            return
+        self.handle_query(query)
+
+    def handle_query(self, query):
+        text = query.get("text")
+        try:
+            document_limit = int(query.get("limit", DOCUMENT_LIMIT))
+        except Exception:
+            document_limit = 0
+        if not text or document_limit <= 0:
+            self.send_json(400, {"error": "Query requires 'text' and a positive 'limit'"})
+            return
+        group = query.get("group") in [True, 1, "1", "true"]
+        try:
+            hits = search_chroma_db(self.chroma_collection, text, document_limit, INCLUDE_FIELDS, group, self.query_cache, self.lexical_search)
+        except Exception as e:
+            log(f"Failed to query Chroma DB: {str(e)}")
+            self.send_json(500, {"error": "Failed to query Chroma DB"})
+            return
+        self.send_json(200, {"results": hits})
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # the default implementation expects a host and port, Unix socket clients have none
+        if not self.quiet:
+            log(format % args)
+
+
+class UnixQueryServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_queries(chroma_collection, host=SERVER_HOST, port=SERVER_PORT, socket_path=None, query_cache=None, lexical_search=None, quiet=False):
+    # the collection and its embedding function stay open between queries, every request runs in its own thread
+    handler = type("BoundQueryHandler", (QueryHandler,), {
+        "chroma_collection": chroma_collection, "lexical_search": lexical_search, "query_cache": query_cache, "quiet": quiet})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixQueryServer(socket_path, handler)
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        address = f"http://{host}:{port}"
+    log(f"Serving queries: {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log("Stopping query server")
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
 # entry point
 
 
 def main(args):
-    chroma_collection = handle_chroma_arg(args)
-    if not chroma_collection:
+    if args.batch and not args.output:
+        # JSONL records go to stdout, logging would break them
+        args.quiet = True
+    lexical_search = None
+    if args.mode != "vector":
+        lexical_search = handle_lexical_arg(args)
+        if not lexical_search:
+            sys.exit(1)
+    # lexical search alone needs neither Chroma DB nor embeddings
+    chroma_collection = None
+    if args.mode != "lexical":
+        chroma_collection = handle_chroma_arg(args)
+        if not chroma_collection:
+            sys.exit(1)
+    cache_size = handle_count_arg(args, "cache_size", QUERY_CACHE_SIZE)
+    cache_ttl = handle_count_arg(args, "cache_ttl", QUERY_CACHE_TTL)
+    metrics_reporter = handle_metrics_args(args)
+    if not cache_size or not cache_ttl or not metrics_reporter:
         sys.exit(1)
+    query_cache = None
+    if not args.no_cache and chroma_collection:
+        query_cache = QueryCache(
+            args.cache or os.path.join(args.chroma, QUERY_CACHE_FILE_NAME),
+            cache_size * 1024 * 1024,
+            cache_ttl,
+            get_version_path(args.chroma, chroma_collection.name))
+    metrics_reporter.start()
+    try:
+        run_queries(args, chroma_collection, query_cache, lexical_search)
+    finally:
+        metrics_reporter.stop()
+        if lexical_search:
+            lexical_search.close()
+        if query_cache:
+            if not args.quiet:
+                log(f"Query cache: {json.dumps(query_cache.stats())}")
+            query_cache.close()
+
+
+def handle_lexical_arg(args):
+    target_folder = handle_arg(args, 'folder')
+    if not target_folder:
+        log(f"Argument 'folder' is required in {args.mode} mode")
+        return None
+    lexical_index = open_lexical_index(target_folder, False)
+    if lexical_index is None:
+        log(f"Lexical index was not found in the data folder: {target_folder}")
+        return None
+    return LexicalSearch(lexical_index, open_corpus(target_folder), args.mode == "hybrid")
+
+
+def run_queries(args, chroma_collection, query_cache, lexical_search):
+    if args.serve:
+        serve_queries(chroma_collection, args.host, args.port, args.socket, query_cache, lexical_search, args.quiet)
+        log("Bye!")
+        return
     document_limit = handle_limit_arg(args, DOCUMENT_LIMIT)
     if not document_limit:
         sys.exit(1)
+    if args.batch:
+        batch_size = handle_count_arg(args, "batch_size", QUERY_BATCH_SIZE)
+        if not batch_size:
+            sys.exit(1)
+        include = args.include.split(",")
+        if any(field not in INCLUDE_FIELDS for field in include):
+            log(f"Argument 'include' is not valid: {args.include}")
+            sys.exit(1)
+        if not args.quiet:
+            log(f"Ready to run batch queries:")
+            log(f"\t Path to Chroma DB: {args.chroma}")
+            log(f"\t Queries: {args.batch}")
+            log(f"\t Results: {args.output}")
+            log(f"\t Batch size: {batch_size}")
+        input_file = sys.stdin if args.batch == "-" else open(args.batch, "r", encoding="utf-8")
+        output_file = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        try:
+            [_, failed_count] = query_chroma_db_batch(
+                chroma_collection, input_file, output_file, document_limit, include, args.group, batch_size, query_cache, lexical_search, args.quiet)
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+            if output_file is not sys.stdout:
+                output_file.close()
+        sys.exit(1 if failed_count else 0)
     if not args.text:
         log("Argument 'text' was not provided")
         sys.exit(1)
@@ -65,22 +549,57 @@ def main(args):
         log(f"\t Path to Chroma DB: {args.chroma}")
         log(f"\t Query text: {args.text}")
         log(f"\t Document limit: {document_limit}")
-    query_chroma_db(chroma_collection, args.text, document_limit, args.quiet)
+        log(f"\t Group by page: {args.group}")
+        log(f"\t Search mode: {args.mode}")
+    query_chroma_db(chroma_collection, args.text, document_limit, args.group, query_cache, lexical_search, args.quiet)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="""
           I can query Chroma DB for scraped web content.
-          Just tell me the path to the Chroma DB folder and some text to find.
+          Just tell me the path to the Chroma DB folder and some text to find,
+          or ask me to serve queries over HTTP.
           Enjoy!
         """)
     parser.add_argument(
         "chroma", help="path to the Chroma DB folder")
     parser.add_argument(
-        "text", help="text to search in the Chroma DB")
+        "text", nargs="?", help="text to search in the Chroma DB, not needed with --serve or --batch")
     parser.add_argument(
         "-l", "--limit", type=int, help=f"maximum number of documents to return, by default - {DOCUMENT_LIMIT}")
+    parser.add_argument(
+        "-g", "--group", action="store_true", help=f"group chunk and question/answer hits by page, for collections uploaded with --index chunks")
+    parser.add_argument(
+        "-m", "--mode", choices=QUERY_MODES, default=QUERY_MODE, help=f"vector search in Chroma DB, BM25 search in the lexical index of the data folder, or both, by default - {QUERY_MODE}")
+    parser.add_argument(
+        "--folder", help=f"path to the data folder with the lexical index, required in lexical and hybrid modes")
+    parser.add_argument(
+        "-b", "--batch", help=f"path to a file with one query per line, plain text or JSON, '-' for stdin, results are written as JSONL")
+    parser.add_argument(
+        "--batch-size", type=int, help=f"number of batch queries sent to Chroma DB at once, by default - {QUERY_BATCH_SIZE}")
+    parser.add_argument(
+        "--include", default=",".join(INCLUDE_FIELDS), help=f"comma-separated fields of batch query results, by default - {','.join(INCLUDE_FIELDS)}")
+    parser.add_argument(
+        "-o", "--output", help=f"path to the JSONL file to write batch query results to, stdout by default")
+    parser.add_argument(
+        "-s", "--serve", action="store_true", help=f"keep Chroma DB open and serve queries over HTTP")
+    parser.add_argument(
+        "--host", default=SERVER_HOST, help=f"host to serve queries on, by default - {SERVER_HOST}")
+    parser.add_argument(
+        "--port", type=int, default=SERVER_PORT, help=f"port to serve queries on, by default - {SERVER_PORT}")
+    parser.add_argument(
+        "--socket", help=f"path to a Unix socket to serve queries on instead of the host and port")
+    parser.add_argument(
+        "--cache", help=f"path to the cache of query results, by default - {QUERY_CACHE_FILE_NAME} in the Chroma DB folder")
+    parser.add_argument(
+        "--cache-size", type=int, help=f"maximum size of the cache of query results in MB, by default - {QUERY_CACHE_SIZE}")
+    parser.add_argument(
+        "--cache-ttl", type=int, help=f"number of seconds query results are cached for, by default - {QUERY_CACHE_TTL}")
+    parser.add_argument(
+        "--no-cache", action="store_true", help=f"do not cache query results")
+    add_embedding_args(parser)
+    add_metrics_args(parser)
     parser.add_argument(
         "-q", "--quiet", action="store_true", help=f"suppress logging to stdout")
     args = parser.parse_args()
@@ -0,0 +1,146 @@
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from const import *
+from metrics import *
+from util import *
+
+SCHEDULER_CONCURRENCY = 8
+SCHEDULER_REQUEST_LIMIT = 3500
+SCHEDULER_TOKEN_LIMIT = 90000
+SCHEDULER_RETRIES = 5
+SCHEDULER_BACKOFF = 1
+SCHEDULER_BACKOFF_LIMIT = 60
+SCHEDULER_TIMEOUT = 120
+
+
+def get_retryable_errors():
+    # openai is loaded with the first request, not by scripts which only parse arguments
+    import openai
+    return (
+        openai.error.APIConnectionError,
+        openai.error.APIError,
+        openai.error.RateLimitError,
+        openai.error.ServiceUnavailableError,
+        openai.error.Timeout,
+        openai.error.TryAgain,
+    )
+
+
+class SchedulerStopped(Exception):
+    pass
+
+
+class RateBucket:
+    """Token bucket refilled continuously up to its per-minute capacity."""
+
+    def __init__(self, limit_per_minute):
+        self.capacity = limit_per_minute
+        self.available = limit_per_minute
+        self.lock = threading.Lock()
+        self.rate = limit_per_minute / 60
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount, stopped):
+        # requests larger than the bucket wait for a full bucket
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self.refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                delay = (amount - self.available) / self.rate
+            if stopped.wait(delay):
+                raise SchedulerStopped()
+
+    def release(self, amount):
+        with self.lock:
+            self.refill()
+            self.available = min(self.capacity, self.available + amount)
+
+
+def get_retry_after(error):
+    headers = getattr(error, "headers", None) or {}
+    for key in ["retry-after", "Retry-After"]:
+        try:
+            return max(float(headers[key]), 0)
+        except:
+            pass
+    return None
+
+
+class Scheduler:
+    """
+    Runs ChatCompletion requests in a thread pool within request-per-minute and token-per-minute budgets,
+    retrying rate-limited and failed requests with exponential backoff or after the delay the API asks for.
+    """
+
+    def __init__(self, concurrency=SCHEDULER_CONCURRENCY, request_limit=SCHEDULER_REQUEST_LIMIT, token_limit=SCHEDULER_TOKEN_LIMIT, retries=SCHEDULER_RETRIES, quiet=False):
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.quiet = quiet
+        self.request_bucket = RateBucket(request_limit)
+        self.retries = retries
+        self.stopped = threading.Event()
+        self.token_bucket = RateBucket(token_limit)
+
+    def request(self, messages, max_tokens, token_count):
+        # prompt and completion tokens are reserved upfront, unused ones are returned after the reply
+        import openai
+        reserved = token_count + max_tokens
+        retryable_errors = get_retryable_errors()
+        for attempt in range(self.retries + 1):
+            # requests queued before the stop are not sent, buckets may have budget for them right away
+            if self.stopped.is_set():
+                raise SchedulerStopped()
+            self.request_bucket.acquire(1, self.stopped)
+            self.token_bucket.acquire(reserved, self.stopped)
+            if self.stopped.is_set():
+                raise SchedulerStopped()
+            count_metric("llm.requests")
+            try:
+                with timed("llm"):
+                    response = openai.ChatCompletion.create(
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        model=GPT_MODEL_NAME,
+                        request_timeout=SCHEDULER_TIMEOUT,
+                        temperature=GPT_TEMPERATURE
+                    )
+                usage = response.get("usage", {})
+                for field in ["prompt_tokens", "completion_tokens", "total_tokens"]:
+                    count_metric(f"llm.{field}", usage.get(field, 0))
+                used = usage.get("total_tokens", reserved)
+                self.token_bucket.release(reserved - used)
+                return response
+            except retryable_errors as error:
+                count_metric("llm.errors")
+                if attempt >= self.retries:
+                    raise
+                delay = get_retry_after(error)
+                reason = f"{type(error).__name__} {error}"
+            if delay is None:
+                delay = min(SCHEDULER_BACKOFF * 2 ** attempt, SCHEDULER_BACKOFF_LIMIT) * random.uniform(0.5, 1)
+            count_metric("llm.retries")
+            if not self.quiet:
+                log(f"Retrying Chat GPT request in {delay:.1f}s: {reason}")
+            if self.stopped.wait(delay):
+                raise SchedulerStopped()
+
+    def submit(self, messages, max_tokens, token_count):
+        return self.executor.submit(self.request, messages, max_tokens, token_count)
+
+    def stop(self):
+        # queued and retried requests fail fast, requests in flight complete
+        self.stopped.set()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
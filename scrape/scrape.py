@@ -1,5 +1,4 @@
 import argparse
-import json
 import os
 import re
 import threading
@@ -7,13 +6,24 @@ import time
 import signal
 import sys
 
-from unstructured.partition.html import partition_html
-from unstructured.staging.base import elements_to_json
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from urllib.parse import urljoin
 
+from corpus import *
+from fingerprint import *
+from frontier import *
+from lexical import *
+from metrics import *
+from priority import *
 from util import *
 
+CONCURRENCY = 8
 DOCUMENT_LIMIT = 10000
+FETCH_DELAY = 0.1
+FETCH_TIMEOUT = 30
+HOST_CONCURRENCY = 4
+WORKERS = os.cpu_count() or 1
 
 # graceful shutdown
 shutdown_requested = False
@@ -31,14 +41,70 @@ signal.signal(signal.SIGTERM, signal_handler)
 # main logic
 
 
-def fetch_url(target_url, target_name, quiet):
+def make_session(concurrency):
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def make_host_slots(host_concurrency):
+    lock = threading.Lock()
+    slots = {}
+    def get_host_slot(target_url):
+        netloc = urlparse(target_url).netloc
+        with lock:
+            if netloc not in slots:
+                slots[netloc] = threading.BoundedSemaphore(host_concurrency)
+            return slots[netloc]
+    return get_host_slot
+
+
+def download_url(session, get_host_slot, target_url, target_name, quiet, etag=None, modified=None):
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if modified:
+        headers["If-Modified-Since"] = modified
+    try:
+        if not quiet:
+            log(f"Fetching url: {target_url} {target_name}")
+        with get_host_slot(target_url):
+            time.sleep(FETCH_DELAY)
+            with timed("fetch"):
+                response = session.get(target_url, headers=headers, timeout=FETCH_TIMEOUT)
+        if response.status_code == 304:
+            count_metric("fetch.not_modified")
+            return {"etag": etag, "modified": modified}
+        response.raise_for_status()
+        count_metric("fetch.pages")
+        count_metric("fetch.bytes", len(response.content))
+        content_type = response.headers.get("Content-Type", "")
+        if "html" not in content_type:
+            log(f"Fetched page is not HTML: {target_url} {target_name} {content_type}")
+            return None
+        return {
+            "etag": response.headers.get("ETag"),
+            "html": response.text,
+            "modified": response.headers.get("Last-Modified")
+        }
+    except:
+        count_metric("fetch.failed")
+        log(f"Failed to fetch url: {target_url} {target_name}")
+        return None
+
+
+def parse_html(target_url, html, target_name, quiet):
+    from unstructured.partition.html import partition_html
+    from unstructured.staging.base import elements_to_json
     list_index = 0
     page_links = []
     page_texts = []
     try:
-        if not quiet:
-            log(f"Fetching url: {target_url} {target_name}")
-        elements = partition_html(url=target_url)
+        elements = partition_html(text=html)
         for element in elements:
             if not hasattr(element, "text") or not element.text:
                 continue
@@ -69,47 +135,205 @@ def fetch_url(target_url, target_name, quiet):
                         page_links.append([link_url])
         if not len(page_texts):
             log(f"Fetched page has no texts: {target_url} {target_name}\n{elements_to_json(elements, indent=2)}")
-            return None, None
-        return page_links, page_texts
+            return None, None, None
+        simhash = compute_page_simhash("\n".join(page_texts))
+        return page_links, page_texts, simhash
     except:
-        log(f"Failed to fetch url: {target_url} {target_name}")
-        return None, None
+        log(f"Failed to parse page: {target_url} {target_name}")
+        return None, None, None
+
+
+def init_parse_worker():
+    # parse workers are stopped by the main process, not by signals
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # unstructured is loaded by every worker once, before the first page, not by the main process
+    import unstructured.partition.html
+
+
+def save_page(corpus, target_url, target_name, page_links, page_texts, page):
+    text = "\n".join(page_texts)
+    corpus.write_text(target_name, text)
+    corpus.write_json(target_name, {
+        "url": target_url,
+        "name": target_name,
+        "links": page_links,
+        "etag": page.get("etag"),
+        "modified": page.get("modified"),
+        "hash": hash_text(text)
+    })
+
+
+def read_page_text(corpus, target_name):
+    try:
+        return corpus.read_text(target_name)
+    except:
+        return None
 
 
-def scrape_url(base_url, target_folder, url_filter, document_limit=DOCUMENT_LIMIT, quiet=False):
+def read_page_hash(corpus, target_name):
+    text = read_page_text(corpus, target_name)
+    return None if text is None else hash_text(text)
+
+
+def scrape_url(base_url, corpus, url_filter, document_limit=DOCUMENT_LIMIT, concurrency=CONCURRENCY, host_concurrency=HOST_CONCURRENCY, workers=WORKERS, migrate=False, refresh=False, similarity=SIMILARITY_THRESHOLD, policy=CRAWL_POLICY, boosts=[], sitemap=False, on_page=None, quiet=False):
     document_count = 0
-    [pending_urls, scraped_urls, _] = restore_session(
-        target_folder, url_filter, document_limit, quiet)
-    if (len(pending_urls) == 0):
-        pending_urls.add(base_url)
-    if not quiet:
-        log(f"Scraping pages: {len(pending_urls)} pending, {len(scraped_urls)} scraped")
+    alias_count = 0
+    changed_count = 0
+    started = get_current_timestamp()
+    frontier = restore_session(corpus, url_filter, migrate, quiet)
+    release_fetching_urls(frontier)
+    lexical_index = restore_lexical_index(corpus, quiet)
+    # links already in the frontier are skipped before they reach the database
+    visited = load_visited_urls(frontier)
+    get_priority = make_priority(policy, boosts)
+    policy_key = get_policy_key(policy, boosts)
+    if get_meta(frontier, 'policy') != policy_key:
+        prioritised_count = prioritise_pending_urls(frontier, get_priority)
+        if not quiet:
+            log(f"Crawl policy changed: {prioritised_count} pending URLs prioritised again")
+    with frontier:
+        set_meta(frontier, 'policy', policy_key)
+
+    def make_links(links, depth):
+        return [[link_url, depth, get_priority(link_url, depth)] for link_url in links]
+
+    session = make_session(concurrency)
+    [pending_count, scraped_count] = count_urls(frontier)
+    if refresh:
+        if not quiet:
+            log(f"Refreshing pages: {scraped_count} scraped")
+    else:
+        if pending_count == 0:
+            reset_pending_url(frontier, base_url, get_priority(base_url, 0))
+            visited.update([base_url])
+            pending_count = 1
+        if sitemap:
+            sitemap_urls = filter_links([[url] for url in fetch_sitemap_urls(session, base_url, quiet)], url_filter, visited)
+            pending_count += add_pending_urls(frontier, make_links(sitemap_urls, SITEMAP_DEPTH))
+        if not quiet:
+            log(f"Scraping pages: {pending_count} pending, {scraped_count} scraped")
+    get_host_slot = make_host_slots(host_concurrency)
+    # downloaded pages wait in a bounded queue for a parse worker,
+    # downloading pauses while the queue is full
+    queue_size = workers * 2
+    # pages being scraped, by URL: [name, etag, modified, hash, depth]
+    known_pages = {}
+    downloaded = deque()
+    downloading = {}
+    parsing = {}
+    set_gauge("scrape.downloading", lambda: len(downloading))
+    set_gauge("scrape.downloaded", lambda: len(downloaded))
+    set_gauge("scrape.parsing", lambda: len(parsing))
     try:
-        while not shutdown_requested and document_count < document_limit and len(pending_urls):
-            time.sleep(0.1)
-            target_url = pending_urls.pop()
-            target_url_hash = hash_url(target_url)
-            page_links, page_texts = fetch_url(
-                target_url, target_url_hash, quiet)
-            if page_texts is None:
-                continue
-            base_path = os.path.join(target_folder, target_url_hash)
-            with open(base_path + ".txt", "w", encoding="utf-8") as file:
-                file.write("\n".join(page_texts))
-            with open(base_path + ".json", "w", encoding="utf-8") as file:
-                json.dump({
-                    "url": target_url,
-                    "name": target_url_hash,
-                    "links": page_links
-                }, file, ensure_ascii=False, indent=2)
-            document_count += 1
-            scraped_urls.add(target_url)
-            pending_urls.update(filter_links(page_links, url_filter))
-            pending_urls -= scraped_urls
-            if not quiet:
-                log(f"Scraping pages: {len(pending_urls)} pending, {len(scraped_urls)} scraped")
+        with ThreadPoolExecutor(max_workers=concurrency) as download_executor, \
+                ProcessPoolExecutor(max_workers=workers, initializer=init_parse_worker) as parse_executor:
+            while True:
+                if not shutdown_requested and len(downloaded) < queue_size:
+                    take_count = min(
+                        concurrency - len(downloading),
+                        document_limit - document_count - len(downloading) - len(downloaded) - len(parsing))
+                    if take_count <= 0:
+                        pages = []
+                    elif refresh:
+                        pages = take_refresh_urls(frontier, started, take_count)
+                    else:
+                        pages = [[url, hash_url(url), None, None, None, depth] for [url, depth] in take_pending_urls(frontier, take_count)]
+                    for [target_url, target_name, etag, modified, text_hash, depth] in pages:
+                        known_pages[target_url] = [target_name, etag, modified, text_hash, depth]
+                        future = download_executor.submit(
+                            download_url, session, get_host_slot, target_url, target_name, quiet, etag, modified)
+                        downloading[future] = target_url
+                while len(downloaded) and len(parsing) < queue_size:
+                    [target_url, page] = downloaded.popleft()
+                    # parse workers are other processes, their latency comes back with the result
+                    future = parse_executor.submit(
+                        measure_call, parse_html, target_url, page["html"], known_pages[target_url][0], quiet)
+                    parsing[future] = [target_url, page]
+                if not downloading and not parsing:
+                    break
+                done, _ = wait(list(downloading) + list(parsing), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in downloading:
+                        target_url = downloading.pop(future)
+                        page = future.result()
+                        if page is None:
+                            known_pages.pop(target_url)
+                            if not refresh:
+                                mark_failed(frontier, target_url)
+                                pending_count -= 1
+                        elif page.get("html") is None:
+                            known_pages.pop(target_url)
+                            mark_unchanged(frontier, target_url, page["etag"], page["modified"])
+                            document_count += 1
+                        else:
+                            downloaded.append([target_url, page])
+                        continue
+                    [target_url, page] = parsing.pop(future)
+                    [target_name, _, _, text_hash, depth] = known_pages.pop(target_url)
+                    try:
+                        [seconds, [page_links, page_texts, simhash]] = future.result()
+                        observe_metric("parse", seconds)
+                        count_metric("parse.pages")
+                    except:
+                        log(f"Failed to parse page: {target_url} {target_name}")
+                        page_texts = None
+                    if page_texts is None:
+                        count_metric("parse.failed")
+                        if not refresh:
+                            mark_failed(frontier, target_url)
+                            pending_count -= 1
+                        continue
+                    document_count += 1
+                    canonical_url = None
+                    if similarity and simhash is not None and not refresh:
+                        canonical_url = find_duplicate(frontier, target_url, simhash, get_max_distance(similarity))
+                    if canonical_url:
+                        links_count = mark_alias(frontier, target_url, canonical_url, make_links(filter_links(page_links, url_filter, visited), depth + 1))
+                        pending_count += links_count - 1
+                        alias_count += 1
+                        count_metric("scrape.duplicates")
+                        if not quiet:
+                            log(f"Page is a near-duplicate: {target_url} of {canonical_url}, {alias_count} duplicates")
+                        continue
+                    old_text = None
+                    if refresh:
+                        if (text_hash or read_page_hash(corpus, target_name)) == hash_text("\n".join(page_texts)):
+                            mark_unchanged(frontier, target_url, page["etag"], page["modified"])
+                            continue
+                        changed_count += 1
+                        count_metric("scrape.changed")
+                        if not quiet:
+                            log(f"Page changed: {target_url} {target_name}")
+                        old_text = read_page_text(corpus, target_name)
+                    elif is_page_indexed(lexical_index, target_name):
+                        # pages scraped again, e.g. the initial page, replace their terms like changed pages
+                        old_text = read_page_text(corpus, target_name)
+                    save_page(corpus, target_url, target_name, page_links, page_texts, page)
+                    count_metric("scrape.pages")
+                    index_page(lexical_index, target_name, target_url, "\n".join(page_texts), old_text)
+                    links_count = mark_scraped(
+                        frontier, target_url, target_name, make_links(filter_links(page_links, url_filter, visited), depth + 1),
+                        page["etag"], page["modified"], hash_text("\n".join(page_texts)), simhash)
+                    count_metric("scrape.links", links_count)
+                    if on_page:
+                        # may block while later stages are busy, holding the crawl back
+                        on_page(target_url, target_name)
+                    if refresh:
+                        pending_count += links_count
+                        if not quiet:
+                            log(f"Refreshing pages: {document_count} checked, {changed_count} changed, {len(downloading) + len(downloaded) + len(parsing)} in progress")
+                    else:
+                        pending_count += links_count - 1
+                        scraped_count += 1
+                        if not quiet:
+                            log(f"Scraping pages: {pending_count} pending, {scraped_count} scraped, {len(downloading) + len(downloaded) + len(parsing)} in progress")
     except KeyboardInterrupt:
         pass
+    finally:
+        session.close()
+        frontier.close()
+        lexical_index.close()
 
 # entry point
 
@@ -118,27 +342,46 @@ def main(args):
     # parse args
     target_folder = handle_folder_arg(args)
     document_limit = handle_limit_arg(args, DOCUMENT_LIMIT)
+    concurrency = handle_count_arg(args, 'concurrency', CONCURRENCY)
+    host_concurrency = handle_count_arg(args, 'host_concurrency', HOST_CONCURRENCY)
+    workers = handle_count_arg(args, 'workers', WORKERS)
+    similarity = None if args.no_dedup else handle_similarity_arg(args, SIMILARITY_THRESHOLD, SIMILARITY_LIMIT)
+    boosts = handle_boost_arg(args)
     [base_url, parsed_url] = handle_url_arg(args)
     if parsed_url:
         netloc = re.escape(parsed_url.netloc)
         scheme = re.escape(parsed_url.scheme)
         default_filter = fr"^{scheme}://{netloc}(?:[^/]+/)*[^.]+(?:\.html?)?$"
         url_filter = handle_filter_arg(args, default_filter)
-    if not document_limit or not parsed_url or not target_folder or not url_filter:
+    metrics_reporter = handle_metrics_args(args)
+    storage = handle_storage_arg(args, target_folder) if target_folder else None
+    if not document_limit or not concurrency or not host_concurrency or not workers or not parsed_url or not target_folder or not url_filter \
+            or (similarity is None and not args.no_dedup) or boosts is None or not metrics_reporter or not storage:
         sys.exit(1)
+    corpus = open_corpus(target_folder, storage, args.compress)
     log(f"Ready to scrape web pages using args:")
     log(f"  Initial page URL: {base_url}")
     log(f"  Path to target folder: {target_folder}")
     log(f"  URL filter: {url_filter}")
     log(f"  Document limit: {document_limit}")
+    log(f"  Concurrency: {concurrency} total, {host_concurrency} per host")
+    log(f"  Parse workers: {workers}")
+    log(f"  Storage: {corpus.storage}")
+    log(f"  Crawl policy: {args.policy}{''.join(f', boost {boost}' for boost in boosts)}{', sitemap' if args.sitemap else ''}")
+    log(f"  Near-duplicates: {'kept' if similarity is None else f'{similarity} similarity'}")
+    if args.refresh:
+        log(f"  Refreshing scraped pages")
     thread = threading.Thread(
         target=scrape_url,
-        args=(base_url, target_folder, re.compile(
-            url_filter), document_limit, args.quiet)
+        args=(base_url, corpus, re.compile(
+            url_filter), document_limit, concurrency, host_concurrency, workers, args.migrate, args.refresh, similarity, args.policy, boosts, args.sitemap, None, args.quiet)
     )
     thread.daemon = True
+    metrics_reporter.start()
     thread.start()
     thread.join()
+    metrics_reporter.stop()
+    corpus.close()
     log("Bye!")
 
 
@@ -157,6 +400,31 @@ if __name__ == "__main__":
         "-f", "--filter", help="optional regex filtering links found on scrapped pages, by default - base URL of the initial page")
     parser.add_argument(
         "-l", "--limit", type=int, help=f"maximum number of URLs to fetch, by default - {DOCUMENT_LIMIT}")
+    parser.add_argument(
+        "-c", "--concurrency", type=int, help=f"maximum number of pages fetched in parallel, by default - {CONCURRENCY}")
+    parser.add_argument(
+        "--host-concurrency", type=int, help=f"maximum number of pages fetched in parallel from one host, by default - {HOST_CONCURRENCY}")
+    parser.add_argument(
+        "-w", "--workers", type=int, help=f"number of processes parsing fetched pages, by default - number of CPUs ({WORKERS})")
+    parser.add_argument(
+        "-s", "--storage", choices=CORPUS_STORAGES, help=f"format of scraped pages, by default - format of pages already in the data folder or files")
+    parser.add_argument(
+        "-z", "--compress", action="store_true", help=f"compress records of new segments, with segments storage")
+    parser.add_argument(
+        "-m", "--migrate", action="store_true", help=f"rebuild the crawl frontier from scraped files in the data folder")
+    parser.add_argument(
+        "-r", "--refresh", action="store_true", help=f"revisit scraped pages and rewrite the ones which content changed, instead of scraping new pages")
+    parser.add_argument(
+        "-p", "--policy", choices=list(CRAWL_POLICIES), default=CRAWL_POLICY, help=f"order of pending pages, by link depth or by URL path length, by default - {CRAWL_POLICY}")
+    parser.add_argument(
+        "-b", "--boost", action="append", help=f"regex of URLs scraped before all others, may be repeated")
+    parser.add_argument(
+        "--sitemap", action="store_true", help=f"add pages listed in sitemaps of the site, found in robots.txt or sitemap.xml")
+    parser.add_argument(
+        "--similarity", type=float, help=f"similarity of page texts above which pages are near-duplicates, above {SIMILARITY_LIMIT}, by default - {SIMILARITY_THRESHOLD}")
+    parser.add_argument(
+        "--no-dedup", action="store_true", help=f"keep near-duplicate pages")
+    add_metrics_args(parser)
     parser.add_argument(
         "-q", "--quiet", action="store_true", help=f"suppress logging to stdout")
     args = parser.parse_args()
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+from embedding import *
+
+
+class EmbeddingCacheTest(unittest.TestCase):
+    # tokens are counted by words, tiktoken downloads its encoding on first use
+    @mock.patch("embedding.count_text_tokens", lambda text: len(text.split()))
+    def test_cached_embeddings_equal_fresh_ones(self):
+        calls = []
+
+        def embed(texts):
+            calls.append(texts)
+            # float64 values not representable as float32
+            return [[0.1 * (index + 1), 1 / 3, 2 / 7] for index, _ in enumerate(texts)]
+
+        with tempfile.TemporaryDirectory() as folder:
+            cache = DiskCache(os.path.join(folder, EMBEDDING_CACHE_FILE_NAME))
+            embedding_function = EmbeddingFunction("test", "test", embed, cache)
+            texts = ["first text", "second text"]
+            fresh = embedding_function(texts)
+            cached = embedding_function(texts)
+            cache.close()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(fresh, cached)
+
+
+if __name__ == "__main__":
+    unittest.main()
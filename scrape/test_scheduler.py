@@ -0,0 +1,35 @@
+import threading
+import unittest
+
+from concurrent.futures import wait
+from unittest import mock
+
+from scheduler import *
+
+
+class SchedulerStopTest(unittest.TestCase):
+    def test_queued_requests_are_not_sent_after_stop(self):
+        sent = []
+        release = threading.Event()
+
+        def create(**kwargs):
+            sent.append(kwargs)
+            release.wait(5)
+            return {"usage": {"total_tokens": 1}}
+
+        scheduler = Scheduler(concurrency=2, quiet=True)
+        with mock.patch("openai.ChatCompletion.create", side_effect=create):
+            futures = [scheduler.submit([{"role": "user", "content": "text"}], 10, 10) for _ in range(20)]
+            while len(sent) < 2:
+                release.wait(0.01)
+            scheduler.stop()
+            release.set()
+            wait(futures)
+            scheduler.shutdown()
+        # requests in flight complete, queued ones fail without being sent
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(sum(1 for future in futures if isinstance(future.exception(), SchedulerStopped)), 18)
+
+
+if __name__ == "__main__":
+    unittest.main()
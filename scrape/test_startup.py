@@ -0,0 +1,21 @@
+import os
+import sys
+import unittest
+
+from bench import *
+
+
+class StartupTest(unittest.TestCase):
+    def test_scripts_parse_help_within_budget_without_heavy_modules(self):
+        [_, baseline_seconds] = run_command([sys.executable, "-c", "pass"], 3)
+        for script in STARTUP_SCRIPTS:
+            with self.subTest(script=script):
+                command = [os.path.join(os.path.dirname(os.path.abspath(__file__)), script), "--help"]
+                [process, seconds] = run_command([sys.executable, *command], 3)
+                self.assertEqual(process.returncode, 0, process.stderr)
+                self.assertLessEqual(seconds - baseline_seconds, STARTUP_BUDGET)
+                self.assertEqual(sorted(find_imported_modules(command) & set(STARTUP_HEAVY_MODULES)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
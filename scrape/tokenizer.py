@@ -0,0 +1,103 @@
+import hashlib
+import threading
+
+from collections import OrderedDict
+
+from const import *
+
+TOKEN_CACHE_SIZE = 65536
+# https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3
+
+_encoding = None
+_encoding_lock = threading.Lock()
+# token counts of recently counted texts, by content hash
+_token_counts = OrderedDict()
+_token_counts_lock = threading.Lock()
+# token counts of dialog templates rendered with empty content, by template function
+_template_token_counts = {}
+
+
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                import tiktoken
+                _encoding = tiktoken.encoding_for_model(GPT_MODEL_NAME)
+    return _encoding
+
+
+def encode_text(text):
+    return get_encoding().encode(text)
+
+
+def encode_texts(texts):
+    return get_encoding().encode_batch(texts)
+
+
+def decode_tokens(tokens):
+    # a cut may split a multi-byte character, its bytes are dropped
+    return get_encoding().decode_bytes(tokens).decode("utf-8", "ignore")
+
+
+def hash_content(text):
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+def get_cached_count(key):
+    with _token_counts_lock:
+        count = _token_counts.get(key)
+        if count is not None:
+            _token_counts.move_to_end(key)
+        return count
+
+
+def set_cached_count(key, count):
+    with _token_counts_lock:
+        _token_counts[key] = count
+        _token_counts.move_to_end(key)
+        while len(_token_counts) > TOKEN_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+
+
+def count_text_tokens(text):
+    key = hash_content(text)
+    count = get_cached_count(key)
+    if count is None:
+        count = len(encode_text(text))
+        set_cached_count(key, count)
+    return count
+
+
+def count_texts_tokens(texts):
+    keys = [hash_content(text) for text in texts]
+    counts = [get_cached_count(key) for key in keys]
+    missing = [index for index, count in enumerate(counts) if count is None]
+    if missing:
+        for index, tokens in zip(missing, encode_texts([texts[index] for index in missing])):
+            counts[index] = len(tokens)
+            set_cached_count(keys[index], counts[index])
+    return counts
+
+
+def count_dialog_tokens(messages):
+    num_tokens = 0
+    for message in messages:
+        num_tokens += TOKENS_PER_MESSAGE
+        for key, value in message.items():
+            num_tokens += count_text_tokens(value)
+            if key == "name":
+                num_tokens += TOKENS_PER_NAME
+    num_tokens += TOKENS_PER_REPLY
+    return num_tokens
+
+
+def count_template_tokens(make_dialog):
+    count = _template_token_counts.get(make_dialog)
+    if count is None:
+        count = count_dialog_tokens(make_dialog(""))
+        _template_token_counts[make_dialog] = count
+    return count
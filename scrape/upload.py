@@ -1,22 +1,36 @@
 import argparse
-import math
-import numpy
-import openai
 import os
-import regex
 import signal
 import sys
-import time
-import tiktoken
 import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
+from cache import *
 from const import *
+from corpus import *
+from frontier import *
+from metrics import *
 from prompt import *
+from scheduler import *
+from tokenizer import *
 from util import *
+from writer import *
 
+CHAT_CACHE_FILE_NAME = "cache.sqlite"
+CHAT_CACHE_SIZE = 1024
 DOCUMENT_LIMIT = 100
-
-openai.api_key = os.getenv("OPENAI_API_KEY")
+INDEX_MODES = ["pages", "chunks"]
+INDEX_MODE = "pages"
+# chunks up to this share of the chunk token limit are packed with chunks of other documents
+PACK_CHUNK_SHARE = 0.25
+# maximum number of chunks in one packed request, replies to more articles get less reliable
+PACK_SIZE = 8
+# tokens of the reply reserved for every packed article, the prompt asks for detailed answers to each one
+PACK_REPLY_TOKENS = 512
+# seconds the first chunk of a pack waits for more chunks before the pack is sent anyway
+PACK_WAIT = 1
 
 # graceful shutdown
 shutdown_requested = False
@@ -33,212 +47,418 @@ signal.signal(signal.SIGTERM, signal_handler)
 
 # main logic
 
-def count_content_tokens(content):
-    encoding = tiktoken.encoding_for_model(GPT_MODEL_NAME)
-    return len(encoding.encode(content))
-
-def count_dialog_tokens(messages):
-    encoding = tiktoken.encoding_for_model(GPT_MODEL_NAME)
-    # https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-    tokens_per_message = 3
-    tokens_per_name = 1
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += 3
-    return num_tokens
-
-def upsert_document(chroma_collection, document, quiet=False):
-    target_name = document['name']
+def make_records(document, index_mode=INDEX_MODE):
     target_url = document['url']
-    texts = []
-    for chunk in document['chunks']:
-        texts.append(chunk["chunk"])
-        texts.append("---")
-        for [question, answer] in zip(chunk['questions'], chunk['answers']):
-            texts.append(question)
-            texts.append(answer)
     link_texts = []
     link_urls = []
     for link in document["links"]:
         link_urls.append(link[0])
         link_texts.append(link[1] if len(link) > 1 else "")
+    updated = datetime.now().isoformat() # TODO: use web page metadata
     metadata = {
         "link_urls": "\n".join(link_urls),
         "link_texts": "\n".join(link_texts),
-        "updated": datetime.now().isoformat() # TODO: use web page metadata
+        "updated": updated,
+        "url": target_url
     }
-    document = "\n".join(texts)
-    try:
-        if not quiet:
-            log(f"Upserting document to Chroma DB: {target_url} {target_name}")
-        chroma_collection.upsert(
-            documents=[document],
-            metadatas=[metadata],
-            ids=[target_url]
-        )
-        return True
-    except:
-        log(f"Failed to upsert document to Chroma DB: {target_url} {target_name}")
-    return False
-
+    if index_mode == "chunks":
+        # every chunk and every question/answer pair is a record of its own, linked to the page by url
+        records = []
+        for chunk_index, chunk in enumerate(document['chunks']):
+            chunk_id = f"{target_url}#chunk-{chunk_index}"
+            records.append([chunk_id, chunk["chunk"], {**metadata, "kind": "chunk", "chunk": chunk_index}])
+            for qa_index, [question, answer] in enumerate(zip(chunk['questions'], chunk['answers'])):
+                records.append([f"{chunk_id}-qa-{qa_index}", f"{question}\n{answer}", {
+                    "chunk": chunk_index,
+                    "kind": "qa",
+                    "updated": updated,
+                    "url": target_url
+                }])
+        return records
+    texts = []
+    for chunk in document['chunks']:
+        texts.append(chunk["chunk"])
+        texts.append("---")
+        for [question, answer] in zip(chunk['questions'], chunk['answers']):
+            texts.append(question)
+            texts.append(answer)
+    return [[target_url, "\n".join(texts), {**metadata, "kind": "page"}]]
 
 
 def extract_chunks(text, token_limit, quiet = False):
+    # every line is tokenized once, chunk sizes are sums of line token counts;
+    # lines are never empty, so the sums never undercount tokens of the joined chunk
     chunks = []
-    new_chunk = True
+    chunk_lines = []
+    chunk_token_count = 0
+    token_limit = int(token_limit)
     title = ""
+    title_tokens = []
     title_done = False
-    title_token_limit = token_limit / 5
-    truncation = regex.compile(r"\p{P}", regex.UNICODE, cache_pattern=True)
-    def truncate_text(text, token_count, token_limit):
-        text_len = len(text)
-        extra_length = math.ceil(
-            (text_len/token_count) * (token_count - token_limit))
-        if extra_length < 1:
-            return text
-        match = truncation.search(text, endpos=text_len - extra_length)
-        if match:
-            return text[:extra_length - match.end()]
-        else:
-            return text
-    for line in text.split("\n"):
+    title_token_limit = int(token_limit / 5)
+    lines = [f"{line}\n" for line in text.split("\n")]
+    for line, line_tokens in zip(lines, encode_texts(lines)):
         if not title_done and line.startswith("Title:"):
-            title += f"{line}\n"
-            token_count = count_content_tokens(title)
-            if token_count > title_token_limit:
-                title = truncate_text(title, token_count, title_token_limit)
+            title += line
+            title_tokens += line_tokens
+            if len(title_tokens) > title_token_limit:
+                title_tokens = title_tokens[:title_token_limit]
+                title = decode_tokens(title_tokens)
                 if not quiet:
                     log(f"Truncated title:\n{title}")
                 title_done = True
         else:
             title_done = True
-            chunk = ""
-            if chunks:
-                chunk = f"{chunks[-1]}{line}\n"
-                token_count = count_content_tokens(chunk)
-                if token_count > token_limit:
-                    new_chunk = True
-            if new_chunk:
-                new_chunk = False
-                chunk = f"{title}{line}\n"
-                token_count = count_content_tokens(chunk)
-                if token_count > token_limit:
-                    chunk = truncate_text(chunk, token_count, token_limit)
-                    if not quiet:
-                        log(f"Truncated text:\n{chunk}")
-                chunks.append(chunk)
-            else:
-                chunks[-1] = chunk
+            if chunk_lines and chunk_token_count + len(line_tokens) <= token_limit:
+                chunk_lines.append(line)
+                chunk_token_count += len(line_tokens)
+                continue
+            if chunk_lines:
+                chunks.append("".join(chunk_lines))
+            chunk_lines = [title, line]
+            chunk_token_count = len(title_tokens) + len(line_tokens)
+            if chunk_token_count > token_limit:
+                chunk_lines = [decode_tokens((title_tokens + line_tokens)[:token_limit])]
+                chunk_token_count = token_limit
+                if not quiet:
+                    log(f"Truncated text:\n{chunk_lines[0]}")
+    if chunk_lines:
+        chunks.append("".join(chunk_lines))
     return chunks
 
 
-def analyse_document(target_name, target_url, text, quiet):
-    token_count = count_dialog_tokens(make_summary_dialog(""))
-    token_limit = (GPT_TOKEN_LIMIT - token_count) / 2
-    chunks = extract_chunks(text, token_limit, quiet)
-    results = []
+def get_chunk_token_limit():
+    # half of the tokens the prompt leaves are for the chunk, the other half for the reply
+    return (GPT_TOKEN_LIMIT - count_template_tokens(make_summary_dialog)) / 2
+
+
+def read_reply_json(response):
+    # replies are sometimes wrapped in a markdown code block despite the template
+    content = response.choices[0].message.content
+    match = re.search(r"```(?:json)?\s*(.*?)```", content, re.DOTALL)
+    return json.loads(match.group(1) if match else content)
+
+
+def make_summary_result(response, reply, share=1):
+    # returns None for replies without question/answer pairs, unpaired questions are left out;
+    # a packed chunk is accounted its share of the usage of the pack
+    try:
+        answers = []
+        questions = []
+        for index, question in enumerate(reply["questions"]):
+            if len(reply["answers"]) > index:
+                questions.append(question)
+                answers.append(reply["answers"][index])
+        if len(questions) > 0 and len(questions) == len(answers):
+            return {
+                "id": response.id,
+                "questions": questions,
+                "answers": answers,
+                "usage": {field: round(count * share) for field, count in response.get("usage", {}).items()}
+            }
+    except:
+        pass
+    return None
+
+
+def split_packed_reply(reply, pack_size):
+    # returns replies by article number, from 1; keys like "Article 2", lists of replies
+    # and replies wrapped in an "articles" field are accepted, other keys are ignored
+    if isinstance(reply, dict) and isinstance(reply.get("articles"), (dict, list)):
+        reply = reply["articles"]
+    if isinstance(reply, dict):
+        items = reply.items()
+    elif isinstance(reply, list):
+        items = enumerate(reply, 1)
+    else:
+        return {}
+    replies = {}
+    for key, value in items:
+        if not isinstance(value, dict):
+            continue
+        match = re.search(r"\d+", str(value.get("article", key)))
+        if match and 1 <= int(match.group()) <= pack_size:
+            replies[int(match.group())] = value
+    return replies
+
+
+class ChunkPacker:
+    """
+    Packs small chunks of different documents into shared Chat GPT requests, so they share the prompt,
+    within the token limit left for articles and a reply budget reserved for every article. A pack is sent when the next chunk does not fit,
+    when it is full, or when its first chunk waited long enough. Every chunk gets a future of its result,
+    or of None for unexpected replies; chunks missing from a packed reply are analysed by requests of their own.
+    """
+
+    def __init__(self, scheduler, size_limit=PACK_SIZE, wait=PACK_WAIT, quiet=False):
+        self.chunk_token_limit = get_chunk_token_limit() * PACK_CHUNK_SHARE
+        self.condition = threading.Condition()
+        self.pack = []
+        self.pack_started = None
+        self.pack_tokens = 0
+        self.quiet = quiet
+        self.scheduler = scheduler
+        self.size_limit = size_limit
+        self.stopped = False
+        # every article takes its tokens and the tokens reserved for its reply
+        self.token_limit = GPT_TOKEN_LIMIT - count_template_tokens(make_packed_summary_dialog)
+        self.wait = wait
+        self.thread = threading.Thread(target=self.run, name="packer", daemon=True)
+        self.thread.start()
+
+    def accepts(self, chunk):
+        return count_text_tokens(chunk) <= self.chunk_token_limit
+
+    def submit(self, chunk):
+        future = Future()
+        with self.condition:
+            token_count = count_text_tokens(format_packed_article(len(self.pack) + 1, chunk)) + PACK_REPLY_TOKENS
+            if self.pack and self.pack_tokens + token_count > self.token_limit:
+                self.send_pack()
+                token_count = count_text_tokens(format_packed_article(1, chunk)) + PACK_REPLY_TOKENS
+            self.pack.append([chunk, future])
+            self.pack_tokens += token_count
+            if len(self.pack) == 1:
+                self.pack_started = time.monotonic()
+                self.condition.notify()
+            if len(self.pack) >= self.size_limit:
+                self.send_pack()
+        return future
+
+    def run(self):
+        with self.condition:
+            while not self.stopped:
+                if self.pack and time.monotonic() - self.pack_started >= self.wait:
+                    self.send_pack()
+                self.condition.wait(self.wait - (time.monotonic() - self.pack_started) if self.pack else None)
+
+    def send_pack(self):
+        # called with the condition held
+        pack = self.pack
+        self.pack = []
+        self.pack_tokens = 0
+        self.send(pack)
+
+    def send(self, pack):
+        if len(pack) == 1:
+            # a chunk left alone is sent as usual, its reply is the same as without packing
+            messages = make_summary_dialog(pack[0][0])
+        else:
+            messages = make_packed_summary_dialog(
+                "".join(format_packed_article(number, chunk) for number, [chunk, _] in enumerate(pack, 1)))
+            count_metric("llm.packed_requests")
+            count_metric("llm.packed_chunks", len(pack))
+        token_count = count_dialog_tokens(messages)
+        max_tokens = GPT_TOKEN_LIMIT - token_count
+        if not self.quiet:
+            log(f"Analysing {len(pack)} chunks with Chat GPT\n\t{token_count}/{max_tokens} tokens")
+        try:
+            request = self.scheduler.submit(messages, max_tokens, token_count)
+        except Exception as error:
+            for [_, future] in pack:
+                future.set_exception(error)
+            return
+        request.add_done_callback(lambda request: self.resolve(pack, request))
+
+    def resolve(self, pack, request):
+        try:
+            response = request.result()
+        except Exception as error:
+            for [_, future] in pack:
+                future.set_exception(error)
+            return
+        try:
+            reply = read_reply_json(response)
+        except:
+            reply = None
+        if len(pack) == 1:
+            pack[0][1].set_result(make_summary_result(response, reply))
+            return
+        replies = split_packed_reply(reply, len(pack))
+        # usage is split by article sizes, the prompt and replies of a pack grow with its articles
+        token_counts = [count_text_tokens(chunk) for [chunk, _] in pack]
+        for number, [chunk, future] in enumerate(pack, 1):
+            result = make_summary_result(response, replies.get(number), token_counts[number - 1] / sum(token_counts))
+            if result:
+                future.set_result(result)
+                continue
+            count_metric("llm.pack_fallbacks")
+            self.send([[chunk, future]])
+
+    def flush(self):
+        # chunks still waiting are sent, their results complete later
+        with self.condition:
+            if self.pack:
+                self.send_pack()
+
+    def close(self):
+        self.flush()
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+
+def analyse_document(scheduler, cache, target_name, target_url, text, quiet, chunks=None, packer=None):
+    if chunks is None:
+        with timed("chunk"):
+            chunks = extract_chunks(text, get_chunk_token_limit(), quiet)
+        count_metric("chunk.chunks", len(chunks))
+    pending_requests = []
     for chunk in chunks:
         messages = make_summary_dialog(chunk)
+        # analysis of a chunk is cached by everything that determines the reply,
+        # packed chunks are cached by the request they would be sent alone with
+        cache_key = make_cache_key(GPT_MODEL_NAME, GPT_TEMPERATURE, messages)
+        cached_result = cache.get_json(cache_key) if cache else None
+        if cached_result:
+            count_metric("llm.cache_hits")
+            pending_requests.append([chunk, cache_key, None, cached_result, False])
+            continue
+        if packer and packer.accepts(chunk):
+            pending_requests.append([chunk, cache_key, packer.submit(chunk), None, True])
+            continue
         token_count = count_dialog_tokens(messages)
         max_tokens = GPT_TOKEN_LIMIT - token_count
         if not quiet:
             log(f"Analysing document with Chat GPT: {target_url} {target_name}\n\t{token_count}/{max_tokens} tokens")
+        pending_requests.append([chunk, cache_key, scheduler.submit(messages, max_tokens, token_count), None, False])
+    # replies are collected in chunk order, a request failed after all retries fails the document
+    results = []
+    failed = False
+    for [chunk, cache_key, request, cached_result, packed] in pending_requests:
+        if cached_result:
+            results.append({"chunk": chunk, **cached_result})
+            continue
         try:
-            response = openai.ChatCompletion.create(
-                messages=messages,
-                max_tokens=GPT_TOKEN_LIMIT - token_count,
-                model=GPT_MODEL_NAME,
-                temperature=GPT_TEMPERATURE
-            )
-            usage = response.get("usage", {})
-            success = False
-            try:
-                reply = json.loads(response.choices[0].message.content)
-                answers = []
-                questions = []
-                for index, question in enumerate(reply["questions"]):
-                    if len(reply["answers"]) > index:
-                        questions.append(question)
-                        answers.append(reply["answers"][index])
-                if len(questions) > 0 and len(questions) == len(answers):
-                    results.append({
-                        "id": response.id,
-                        "chunk": chunk,
-                        "questions": questions,
-                        "answers": answers,
-                        "usage": usage
-                    })
-                    success = True
-            except:
-                pass
-            if not success:
-                log(f"Unexpected Chat GPT response: {target_url} {target_name}\n{response}")
+            response = request.result()
         except:
+            count_metric("llm.failed")
             log(f"Failed to analyse document with Chat GPT: {target_url} {target_name}")
-    return results
+            failed = True
+            continue
+        if packed:
+            result = response
+        else:
+            try:
+                result = make_summary_result(response, read_reply_json(response))
+            except:
+                result = None
+        if result is None:
+            count_metric("llm.unexpected")
+            log(f"Unexpected Chat GPT response: {target_url} {target_name}" + ("" if packed else f"\n{response}"))
+            continue
+        if cache:
+            cache.set_json(cache_key, result)
+        results.append({"chunk": chunk, **result})
+    return None if failed else results
 
 
-def upload_document(chroma_collection, document_path, quiet=False):
+def prepare_document(scheduler, cache, corpus, target_name, quiet=False, packer=None):
     try:
-        with open(document_path, 'r') as file:
-            document = json.load(file)
-        target_name = document['name']
+        document = corpus.read_json(target_name)
         target_url = document['url']
-        with open(change_extension(document_path, '.txt'), 'r') as file:
-            text = file.read()
-        results = analyse_document(target_name, target_url, text, quiet)
+        text = corpus.read_text(target_name)
+        results = analyse_document(scheduler, cache, target_name, target_url, text, quiet, packer=packer)
+        if results is None:
+            return None
         if not results:
             log(f"Could not find content: {target_name}")
-            return False
+            return None
         document["chunks"] = results
-        if not upsert_document(chroma_collection, document, quiet):
-            return False
-        with open(document_path, 'w') as file:
-            if not quiet:
-                log(f"Updating document: {target_url} {target_name}")
-            json.dump(document, file, indent=2, ensure_ascii=False)
+        return document
+    except:
+        log(f"Failed to prepare document: {target_name}")
+    return None
+
+
+def save_document(corpus, document, quiet=False):
+    target_name = document['name']
+    target_url = document['url']
+    try:
+        if not quiet:
+            log(f"Updating document: {target_url} {target_name}")
+        corpus.write_json(target_name, document)
         return True
     except:
-        log(f"Failed to upload document: {target_name}")
+        log(f"Failed to update document: {target_url} {target_name}")
     return False
 
 
-def upload_documents(chroma_collection, target_folder, url_filter, document_limit=DOCUMENT_LIMIT, quiet=False):
-    [_, scraped_urls, scraped_files] = restore_session(
-        target_folder, url_filter, document_limit, quiet)
-    if not scraped_files:
+def restore_uploads(frontier, chroma_collection, reconcile=False, quiet=False):
+    # uploaded flags of the frontier are trusted while they were recorded for the same collection,
+    # otherwise they are reconciled with ids read from the collection page by page
+    collection_id = str(chroma_collection.id)
+    if reconcile or get_meta(frontier, 'collection') != collection_id:
+        if not quiet:
+            log(f"Reconciling uploaded files with Chroma DB collection: {collection_id}")
+        reconcile_uploads(frontier, get_collection_urls(chroma_collection), collection_id)
+
+
+def upload_documents(chroma_collection, writer, scheduler, cache, corpus, url_filter, document_limit=DOCUMENT_LIMIT, concurrency=SCHEDULER_CONCURRENCY, reconcile=False, index_mode=INDEX_MODE, quiet=False, packer=None):
+    frontier = restore_session(corpus, quiet=quiet)
+    if not count_urls(frontier)[1]:
         log(f"No scraped files found, you need to run scrape script first")
         sys.exit(1)
+    restore_uploads(frontier, chroma_collection, reconcile, quiet)
     failed_files = []
-    pending_files = []
-    scraped_files = list(scraped_files)
+    pending_files = [[url, name] for [url, name] in get_pending_uploads(frontier) if url_filter.match(url)]
     uploaded_files = []
-    for index, scraped_url in enumerate(scraped_urls):
-        if url_filter.match(scraped_url):
-            existing_ids = chroma_collection.get(ids=[scraped_url])["ids"]
-            if len(existing_ids) == 0:
-                scraped_file = scraped_files[index]
-                pending_files.append(scraped_file)
     if not quiet:
         log(f"Uploading files: {len(pending_files)} pending")
-    try:
-        while not shutdown_requested and len(uploaded_files) < document_limit and len(pending_files):
-            time.sleep(0.1)
-            document_path = pending_files.pop()
-            result = upload_document(chroma_collection, document_path, quiet)
-            if result == True:
-                uploaded_files.append(document_path)
+    # documents are recorded as uploaded only after their records were upserted
+    def save_documents(upserted, failed):
+        for document in upserted:
+            if save_document(corpus, document, quiet):
+                mark_uploaded(frontier, document['url'])
+                uploaded_files.append(document['name'])
+                count_metric("upload.documents")
             else:
-                failed_files.append(document_path)
-            if not quiet:
-                log(f"Uploading files: {len(pending_files)} pending, {len(uploaded_files)} uploaded, {len(failed_files)} failed")
+                failed_files.append(document['name'])
+                count_metric("upload.failed")
+        for document in failed:
+            failed_files.append(document['name'])
+            count_metric("upload.failed")
+        if (upserted or failed) and not quiet:
+            log(f"Uploading files: {len(pending_files)} pending, {len(uploaded_files)} uploaded, {len(failed_files)} failed")
+    # documents are analysed in parallel, results are saved and recorded by this thread only;
+    # documents of packed chunks wait for their packs, more of them are prepared at once to fill the packs
+    preparing = {}
+    if packer:
+        concurrency *= packer.size_limit
+    set_gauge("upload.pending", lambda: len(pending_files))
+    set_gauge("upload.preparing", lambda: len(preparing))
+    set_gauge("upload.buffered", writer.pending)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                if shutdown_requested:
+                    scheduler.stop()
+                while not shutdown_requested and len(pending_files) and len(preparing) < concurrency \
+                        and len(uploaded_files) + writer.pending() + len(preparing) < document_limit:
+                    [document_url, document_name] = pending_files.pop()
+                    future = executor.submit(prepare_document, scheduler, cache, corpus, document_name, quiet, packer)
+                    preparing[future] = [document_url, document_name]
+                if not preparing:
+                    break
+                done, _ = wait(preparing, timeout=1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    [document_url, document_name] = preparing.pop(future)
+                    document = future.result()
+                    if document is None:
+                        failed_files.append(document_name)
+                        count_metric("upload.failed")
+                        continue
+                    save_documents(*writer.add(make_records(document, index_mode), document))
     except KeyboardInterrupt:
         pass
+    finally:
+        # buffered documents are upserted on shutdown as well
+        save_documents(*writer.flush())
+        frontier.close()
+        if cache and not quiet:
+            stats = cache.stats()
+            log(f"Chat GPT cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries, {stats['size']} bytes")
 
 
 def main(args):
@@ -246,27 +466,69 @@ def main(args):
     document_limit = handle_limit_arg(args, DOCUMENT_LIMIT)
     target_folder = handle_folder_arg(args)
     url_filter = handle_filter_arg(args, r".*")
-    if not chroma_collection or not target_folder or not document_limit or not url_filter:
+    concurrency = handle_count_arg(args, 'concurrency', SCHEDULER_CONCURRENCY)
+    request_limit = handle_count_arg(args, 'rpm', SCHEDULER_REQUEST_LIMIT)
+    token_limit = handle_count_arg(args, 'tpm', SCHEDULER_TOKEN_LIMIT)
+    cache_size = handle_count_arg(args, 'cache_size', CHAT_CACHE_SIZE)
+    batch_size = handle_count_arg(args, 'batch_size', UPSERT_BATCH_SIZE)
+    batch_tokens = handle_count_arg(args, 'batch_tokens', UPSERT_TOKEN_LIMIT)
+    metrics_reporter = handle_metrics_args(args)
+    if not chroma_collection or not target_folder or not document_limit or not url_filter \
+            or not concurrency or not request_limit or not token_limit or not cache_size or not batch_size or not batch_tokens \
+            or not metrics_reporter:
         sys.exit(1)
+    import openai
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    if args.api_base:
+        openai.api_base = args.api_base
+    corpus = open_corpus(target_folder)
+    scheduler = Scheduler(concurrency, request_limit, token_limit, args.retries, args.quiet)
+    writer = ChromaWriter(chroma_collection, batch_size, batch_tokens,
+                          get_version_path(args.chroma, chroma_collection.name), args.quiet)
+    cache = None
+    if not args.no_cache:
+        cache = DiskCache(args.cache or os.path.join(target_folder, CHAT_CACHE_FILE_NAME), cache_size * 1024 * 1024)
+    packer = ChunkPacker(scheduler, quiet=args.quiet) if args.pack else None
     if not args.quiet:
         log(f"Ready to upload using args:")
         log(f"  Path to target folder: {target_folder}")
+        log(f"  Storage: {corpus.storage}")
         log(f"  Path to Chroma DB: {args.chroma}")
         log(f"  Url filter: {url_filter}")
         log(f"  Document limit: {document_limit}")
+        log(f"  Chat GPT requests: {concurrency} in parallel, {request_limit} per minute, {token_limit} tokens per minute")
+        log(f"  Small chunks packing: {'enabled' if packer else 'disabled'}")
+        log(f"  Index mode: {args.index}")
+        log(f"  Upsert batches: {batch_size} records, {batch_tokens} tokens")
+        log(f"  Chat GPT cache: {'disabled' if cache is None else f'{cache_size} MB'}")
     thread = threading.Thread(
         target=upload_documents,
         args=(
             chroma_collection,
-            target_folder,
+            writer,
+            scheduler,
+            cache,
+            corpus,
             re.compile(url_filter),
             document_limit,
-            args.quiet
+            concurrency,
+            args.reconcile,
+            args.index,
+            args.quiet,
+            packer
         )
     )
     thread.daemon = True
+    metrics_reporter.start()
     thread.start()
     thread.join()
+    if packer:
+        packer.close()
+    scheduler.shutdown()
+    metrics_reporter.stop()
+    if cache:
+        cache.close()
+    corpus.close()
     log("Bye!")
 
 
@@ -289,6 +551,34 @@ if __name__ == "__main__":
         "-f", "--filter", help="optional regex pattern filtering scraped pages to upload by URLs")
     parser.add_argument(
         "-l", "--limit", type=int, help=f"maximum number of results to produce, {DOCUMENT_LIMIT} by default")
+    parser.add_argument(
+        "-c", "--concurrency", type=int, help=f"maximum number of Chat GPT requests in parallel, {SCHEDULER_CONCURRENCY} by default")
+    parser.add_argument(
+        "--rpm", type=int, help=f"maximum number of Chat GPT requests per minute, {SCHEDULER_REQUEST_LIMIT} by default")
+    parser.add_argument(
+        "--tpm", type=int, help=f"maximum number of Chat GPT tokens per minute, {SCHEDULER_TOKEN_LIMIT} by default")
+    parser.add_argument(
+        "--retries", type=int, default=SCHEDULER_RETRIES, help=f"number of retries of failed Chat GPT requests, {SCHEDULER_RETRIES} by default")
+    parser.add_argument(
+        "-i", "--index", choices=INDEX_MODES, default=INDEX_MODE, help=f"index whole pages or every chunk and question/answer pair as separate records, {INDEX_MODE} by default")
+    parser.add_argument(
+        "--batch-size", type=int, help=f"maximum number of records upserted to Chroma DB at once, {UPSERT_BATCH_SIZE} by default")
+    parser.add_argument(
+        "--batch-tokens", type=int, help=f"maximum number of tokens upserted to Chroma DB at once, {UPSERT_TOKEN_LIMIT} by default")
+    parser.add_argument(
+        "--cache", help="optional path to the cache of Chat GPT results, by default - cache.sqlite in the data folder")
+    parser.add_argument(
+        "--cache-size", type=int, help=f"maximum size of the cache of Chat GPT results in MB, {CHAT_CACHE_SIZE} by default")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="do not cache Chat GPT results")
+    parser.add_argument(
+        "--pack", action="store_true", help=f"pack small chunks of several pages into shared Chat GPT requests, up to {PACK_SIZE} chunks each")
+    parser.add_argument(
+        "--reconcile", action="store_true", help="re-read uploaded document ids from Chroma DB instead of trusting the frontier")
+    parser.add_argument(
+        "--api-base", help="optional base URL of OpenAI compatible API, e.g. a local test server")
+    add_embedding_args(parser)
+    add_metrics_args(parser)
     parser.add_argument(
         "-q", "--quiet", action="store_true", help=f"suppress logging to stdout")
     args = parser.parse_args()
@@ -1,19 +1,17 @@
-import chromadb
+import functools
 import hashlib
-import json
 import os
 import re
 import sys
-import tiktoken
 import traceback
 
-from chromadb.utils import embedding_functions
 from datetime import datetime
 from urllib.parse import urlparse, urlunparse
 
 from const import *
 
-encoding = tiktoken.encoding_for_model(GPT_MODEL_NAME)
+# canonical forms of recently seen links, pages of one site link to the same URLs over and over
+URL_CACHE_SIZE = 65536
 
 
 def log(message):
@@ -27,22 +25,6 @@ def change_extension(path, new_extension):
     root, _ = os.path.splitext(path)
     return root + new_extension
 
-def count_dialog_tokens(messages, tokens_per_message=3, tokens_per_name=1):
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += tokens_per_message
-    return num_tokens
-
-
-def count_text_tokens(text):
-    return len(encoding.encode(text))
-
-
 def get_current_timestamp():
     return int(datetime.utcnow().timestamp() * 1000)
 
@@ -55,19 +37,49 @@ def handle_arg(args, arg_name, default_value=None):
     return default_value
 
 
+def add_embedding_args(parser):
+    from embedding import EMBEDDING_BACKEND, EMBEDDING_BACKENDS, EMBEDDING_BATCH_SIZE, EMBEDDING_CACHE_FILE_NAME, EMBEDDING_CACHE_SIZE
+    parser.add_argument(
+        "-e", "--embedding", choices=EMBEDDING_BACKENDS, default=EMBEDDING_BACKEND, help=f"embedding backend, local one runs offline on CPU, {EMBEDDING_BACKEND} by default")
+    parser.add_argument(
+        "--embedding-batch", type=int, help=f"maximum number of texts embedded at once, {EMBEDDING_BATCH_SIZE} by default")
+    parser.add_argument(
+        "--embedding-cache", help=f"optional path to the cache of embeddings, by default - {EMBEDDING_CACHE_FILE_NAME} in the Chroma DB folder")
+    parser.add_argument(
+        "--embedding-cache-size", type=int, help=f"maximum size of the cache of embeddings in MB, {EMBEDDING_CACHE_SIZE} by default")
+    parser.add_argument(
+        "--no-embedding-cache", action="store_true", help="do not cache embeddings")
+
+
+def handle_embedding_args(args, path):
+    from embedding import EMBEDDING_BACKEND, EMBEDDING_BATCH_SIZE, EMBEDDING_CACHE_FILE_NAME, EMBEDDING_CACHE_SIZE, make_embedding_function
+    backend = handle_arg(args, 'embedding', EMBEDDING_BACKEND)
+    batch_size = handle_count_arg(args, 'embedding_batch', EMBEDDING_BATCH_SIZE)
+    cache_size = handle_count_arg(args, 'embedding_cache_size', EMBEDDING_CACHE_SIZE)
+    if not batch_size or not cache_size:
+        return None
+    cache_path = None
+    if not getattr(args, 'no_embedding_cache', False):
+        cache_path = getattr(args, 'embedding_cache', None) or os.path.join(path, EMBEDDING_CACHE_FILE_NAME)
+    return make_embedding_function(backend, cache_path, cache_size, batch_size)
+
+
 def handle_chroma_arg(args):
+    from embedding import get_collection_name
     path = handle_arg(args, 'chroma')
     if path:
         try:
+            # Chroma DB takes longer to import than the scripts take to start, it is loaded only when opened
+            import chromadb
             chroma_client = chromadb.PersistentClient(path)
+            embedding_function = handle_embedding_args(args, path)
+            if not embedding_function:
+                return None
             chroma_collection = chroma_client.get_or_create_collection(
-                name="documents",
-                embedding_function=embedding_functions.OpenAIEmbeddingFunction(
-                    api_key=os.getenv("OPENAI_API_KEY"),
-                    model_name="text-embedding-ada-002"
-                ))
+                name=get_collection_name(embedding_function.backend),
+                embedding_function=embedding_function)
             if not args.quiet:
-                log(f"Opened Chroma DB: {str(chroma_collection.count())} documents")
+                log(f"Opened Chroma DB: {str(chroma_collection.count())} documents, {embedding_function.backend} embeddings")
             return chroma_collection
         except Exception as e:
             log(f"Failed to open Chroma DB: {str(e)}")
@@ -105,19 +117,45 @@ def handle_folder_arg(args, create_if_not_exists=True):
     return None
 
 
-def handle_limit_arg(args, default_value):
-    if args.limit:
+def handle_count_arg(args, arg_name, default_value):
+    value = getattr(args, arg_name, None)
+    if value:
         try:
-            limit = int(args.limit)
-            if limit > 0:
-                return limit
+            count = int(value)
+            if count > 0:
+                return count
         except:
             pass
-        log(f"Argument 'limit' is not valid: {args.limit}")
+        log(f"Argument '{arg_name}' is not valid: {value}")
         return None
     return default_value
 
 
+def handle_limit_arg(args, default_value):
+    return handle_count_arg(args, 'limit', default_value)
+
+
+def handle_boost_arg(args):
+    boosts = getattr(args, 'boost', None) or []
+    for boost in boosts:
+        try:
+            re.compile(boost)
+        except Exception:
+            log(f"Argument 'boost' is not valid: {boost}")
+            return None
+    return boosts
+
+
+def handle_similarity_arg(args, default_value, min_value=0):
+    value = getattr(args, 'similarity', None)
+    if value is None:
+        return default_value
+    if min_value < value <= 1:
+        return value
+    log(f"Argument 'similarity' is not valid: {value}, it must be above {min_value} and at most 1")
+    return None
+
+
 def handle_url_arg(args):
     url = handle_arg(args, 'url')
     if url:
@@ -128,8 +166,12 @@ def handle_url_arg(args):
     return [None, None]
 
 
+def hash_text(text):
+    return hashlib.md5(text.encode()).hexdigest()
+
+
 def hash_url(url):
-    return hashlib.md5(url.encode()).hexdigest()
+    return hash_text(url)
 
 
 def normalise_whitespace(text):
@@ -146,36 +188,19 @@ def parse_url(url):
     return [None, None]
 
 
-def filter_links(page_links, url_filter):
+@functools.lru_cache(maxsize=URL_CACHE_SIZE)
+def canonicalise_url(url):
+    return parse_url(url)[0]
+
+
+def filter_links(page_links, url_filter, visited=None):
+    # links already in the visited set are left out, they are in the frontier
     filtered_links = set()
     for link in page_links:
-        [base_url, _] = parse_url(link[0])
-        if base_url and url_filter.match(base_url):
+        base_url = canonicalise_url(link[0])
+        if base_url and base_url not in filtered_links and (visited is None or base_url not in visited) \
+                and url_filter.match(base_url):
             filtered_links.add(base_url)
+    if visited is not None:
+        visited.update(filtered_links)
     return filtered_links
-
-
-def restore_session(target_folder, url_filter, document_limit=None, quiet=False):
-    pending_urls = set()
-    scraped_files = set()
-    scraped_urls = set()
-    file_names = [f for f in os.listdir(target_folder) if f.endswith('.json')]
-    if not file_names:
-        return [pending_urls, scraped_urls, scraped_files]
-    if not quiet:
-        log(f"Restoring session: {len(file_names)} files")
-    for file_name in file_names:
-        file_path = os.path.join(target_folder, file_name)
-        with open(file_path, 'r') as file:
-            document = json.load(file)
-            if 'url' in document:
-                url = document['url']
-                if len(url) and url_filter.match(url):
-                    scraped_files.add(file_path)
-                    scraped_urls.add(url)
-            for link_url in filter_links(document.get('links', []), url_filter):
-                if not link_url in scraped_urls:
-                    pending_urls.add(link_url)
-                    if document_limit and len(pending_urls) >= document_limit:
-                        break
-    return [pending_urls, scraped_urls, scraped_files]
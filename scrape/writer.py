@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+
+from metrics import *
+from tokenizer import *
+from util import *
+
+COLLECTION_PAGE_SIZE = 10000
+UPSERT_BATCH_SIZE = 64
+UPSERT_TOKEN_LIMIT = 100000
+VERSION_FILE_EXTENSION = ".version"
+
+
+def get_collection_urls(chroma_collection, page_size=COLLECTION_PAGE_SIZE):
+    # records of chunks and question/answer pairs have page URLs with a fragment as ids
+    urls = set()
+    offset = 0
+    while True:
+        page = chroma_collection.get(include=[], limit=page_size, offset=offset)["ids"]
+        urls.update(id.split("#")[0] for id in page)
+        if len(page) < page_size:
+            return urls
+        offset += page_size
+
+
+def get_version_path(chroma_path, collection_name):
+    return os.path.join(chroma_path, collection_name + VERSION_FILE_EXTENSION)
+
+
+def read_collection_version(version_path):
+    try:
+        with open(version_path, "r", encoding="utf-8") as file:
+            return file.read()
+    except FileNotFoundError:
+        return ""
+
+
+def bump_collection_version(version_path):
+    # any new value invalidates cached query results, a unique one needs no read-modify-write between processes
+    temporary_path = f"{version_path}.{os.getpid()}.{threading.get_ident()}"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        file.write(f"{time.time_ns()}-{os.getpid()}-{threading.get_ident()}")
+    os.replace(temporary_path, version_path)
+
+
+def upsert_records(chroma_collection, records):
+    # records left from previous uploads of the same pages are replaced, not only updated
+    # upsert latency includes embedding, which Chroma DB computes for the documents
+    urls = list({record[2]["url"] for record in records if "url" in record[2]})
+    with timed("upsert"):
+        if urls:
+            chroma_collection.delete(where={"url": {"$in": urls}})
+        chroma_collection.upsert(
+            documents=[record[1] for record in records],
+            metadatas=[record[2] for record in records],
+            ids=[record[0] for record in records]
+        )
+    count_metric("upsert.batches")
+    count_metric("upsert.records", len(records))
+
+
+class ChromaWriter:
+    """
+    Buffers records of several documents and upserts them to Chroma DB in batches,
+    flushed when the buffer reaches the record count or the token limit.
+    Every item is a list of records, `[id, document, metadata]`, with a context returned
+    back by `add` and `flush` to tell which items were upserted and which failed.
+    The collection version file, when given, is bumped after every upserted batch.
+    """
+
+    def __init__(self, chroma_collection, batch_size=UPSERT_BATCH_SIZE, token_limit=UPSERT_TOKEN_LIMIT, version_path=None, quiet=False):
+        self.batch_size = batch_size
+        self.chroma_collection = chroma_collection
+        self.items = []
+        self.lock = threading.Lock()
+        self.quiet = quiet
+        self.record_count = 0
+        self.token_count = 0
+        self.token_limit = token_limit
+        self.version_path = version_path
+
+    def add(self, records, context):
+        with self.lock:
+            self.items.append([records, context])
+            self.record_count += len(records)
+            self.token_count += sum(count_text_tokens(record[1]) for record in records)
+            if self.record_count < self.batch_size and self.token_count < self.token_limit:
+                return [[], []]
+            return self.flush_items()
+
+    def flush(self):
+        with self.lock:
+            return self.flush_items()
+
+    def flush_items(self):
+        items = self.items
+        self.items = []
+        self.record_count = 0
+        self.token_count = 0
+        if not items:
+            return [[], []]
+        try:
+            return self.upsert_items(items)
+        finally:
+            # records of a failed batch may still be partly deleted or written
+            if self.version_path:
+                try:
+                    bump_collection_version(self.version_path)
+                except:
+                    log(f"Failed to bump collection version: {self.version_path}")
+
+    def upsert_items(self, items):
+        records = [record for [item_records, _] in items for record in item_records]
+        try:
+            if not self.quiet:
+                log(f"Upserting documents to Chroma DB: {len(items)} documents, {len(records)} records")
+            upsert_records(self.chroma_collection, records)
+            return [[context for [_, context] in items], []]
+        except:
+            log(f"Failed to upsert batch to Chroma DB: {len(items)} documents, retrying one by one")
+        # a failed batch is retried item by item to find out which ones fail
+        upserted = []
+        failed = []
+        for [item_records, context] in items:
+            try:
+                upsert_records(self.chroma_collection, item_records)
+                upserted.append(context)
+            except:
+                log(f"Failed to upsert document to Chroma DB: {', '.join(record[0] for record in item_records)}")
+                failed.append(context)
+        return [upserted, failed]
+
+    def pending(self):
+        with self.lock:
+            return len(self.items)